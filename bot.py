@@ -64,6 +64,9 @@ class RoboDanny(commands.AutoShardedBot):
         self.session = aiohttp.ClientSession(loop=self.loop)
         self.pool = pool
 
+        # what to do about commands that sit on an unused connection, see Context.idle_action
+        context.Context.idle_action = getattr(config, 'db_idle_action', context.Context.idle_action)
+
         self._prev_events = deque(maxlen=10)
 
         # shard_id: List[datetime.datetime]
@@ -337,6 +337,53 @@ class Admin(commands.Cog):
         else:
             await ctx.send(fmt)
 
+    @commands.command(hidden=True)
+    async def sql_pool(self, ctx, reset: bool = False):
+        """Shows connection pool statistics."""
+
+        pool = self.bot.pool
+        if not hasattr(pool, 'acquire_wait'):
+            return await ctx.send('The connection pool is not instrumented.')
+
+        suggested_min, suggested_max = pool.suggested_size()
+        output = [
+            f'Size: {pool.min_size}-{pool.max_size}, in use: {pool.in_use} (peak {pool.peak_in_use})',
+            f'Acquisitions: {pool.acquisitions} (exhausted {pool.exhausted}, timed out {pool.timeouts})',
+            f'Queries run on the pool: {pool.queries}',
+            f'Acquire wait: {pool.acquire_wait.summary()}',
+            f'Suggested size: {suggested_min}-{suggested_max}',
+        ]
+
+        if pool.replica is not None:
+            lag = 'unreachable' if pool.replica_lag is None else f'{pool.replica_lag:.2f}s'
+            routed = 'replica' if pool.read_pool is pool.replica else 'primary'
+            output.append(f'Replica lag: {lag} (max {pool.max_replica_lag}s), reads go to the {routed}')
+            output.append(f'Replica acquire wait: {pool.replica.acquire_wait.summary()}')
+
+        hold_times = sorted(pool.hold_times.items(), key=lambda t: t[1].sum, reverse=True)
+        if hold_times:
+            output.append('')
+            output.append('Hold times (by total time held):')
+            for site, histogram in hold_times[:10]:
+                output.append(f'{site}: {histogram.summary()}')
+
+        leaked = pool.leaked()
+        if leaked:
+            output.append('')
+            output.append('Possibly leaked:')
+            for site, held in leaked:
+                output.append(f'{site}: held for {held:.0f}s')
+
+        if reset:
+            pool.reset_stats()
+
+        fmt = '```\n' + '\n'.join(output) + '\n```'
+        if len(fmt) > 2000:
+            fp = io.BytesIO(fmt.encode('utf-8'))
+            await ctx.send('Too many results...', file=discord.File(fp, 'pool.txt'))
+        else:
+            await ctx.send(fmt)
+
     @commands.command(hidden=True)
     async def sudo(self, ctx, channel: Optional[GlobalChannel], who: discord.User, *, command: str):
         """Run a command as another user optionally in another channel."""
@@ -257,7 +257,10 @@ class API(commands.Cog):
         timer = await reminder.create_timer(duration.dt, 'tempblock', ctx.guild.id, ctx.author.id,
                                                                       ctx.channel.id, member.id,
                                                                       connection=ctx.db,
-                                                                      created=ctx.message.created_at)
+                                                                      created=ctx.message.created_at,
+                                                                      author_id=ctx.author.id,
+                                                                      channel_id=ctx.channel.id,
+                                                                      guild_id=ctx.guild.id)
 
         reason = f'Tempblock by {ctx.author} (ID: {ctx.author.id}) until {duration.dt}'
 
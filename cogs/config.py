@@ -56,12 +56,7 @@ class CommandConfig(db.Table, table_name='command_config'):
     name = db.Column(db.String)
     whitelist = db.Column(db.Boolean)
 
-    @classmethod
-    def create_table(cls, *, exists_ok=True):
-        statement = super().create_table(exists_ok=exists_ok)
-        # create the unique index
-        sql = "CREATE UNIQUE INDEX IF NOT EXISTS command_config_uniq_idx ON command_config (channel_id, name, whitelist);"
-        return statement + '\n' + sql
+    uniq = db.Index('channel_id', 'name', 'whitelist', unique=True)
 
 class CommandName(commands.Converter):
     async def convert(self, ctx, argument):
@@ -168,6 +163,44 @@ class ResolvedCommandPermissions:
 
         return self._is_command_blocked(ctx.command.qualified_name, ctx.channel.id)
 
+class StarEligibility:
+    """Tells who can star where in a guild without doing any queries.
+
+    This combines the guild's ignore list with the resolved command
+    permissions of the star command.
+    """
+    __slots__ = ('guild_id', 'plonked', 'permissions', 'blacklist', '_blocked')
+
+    def __init__(self, guild_id, plonked, permissions, blacklist):
+        self.guild_id = guild_id
+        # the ignored channel and member IDs
+        self.plonked = plonked
+        self.permissions = permissions
+        self.blacklist = blacklist
+
+        # channel_id: bool
+        self._blocked = {}
+
+    def is_channel_blocked(self, channel_id):
+        try:
+            return self._blocked[channel_id]
+        except KeyError:
+            blocked = self._blocked[channel_id] = bool(self.permissions.is_command_blocked('star', channel_id))
+            return blocked
+
+    def can_star(self, guild, member_id, channel_id):
+        if self.is_channel_blocked(channel_id):
+            return False
+
+        if member_id in self.blacklist or self.guild_id in self.blacklist:
+            return False
+
+        member = guild.get_member(member_id)
+        if member is not None and member.guild_permissions.manage_guild:
+            return True
+
+        return member_id not in self.plonked and channel_id not in self.plonked
+
 class Config(commands.Cog):
     """Handles the bot's configuration system.
 
@@ -229,6 +262,15 @@ class Config(commands.Cog):
         records = await connection.fetch(query, guild_id)
         return ResolvedCommandPermissions(guild_id, records)
 
+    @cache.cache(maxsize=1024)
+    async def get_star_eligibility(self, guild_id, *, connection=None):
+        connection = connection or self.bot.pool
+        query = "SELECT entity_id FROM plonks WHERE guild_id=$1;"
+
+        records = await connection.fetch(query, guild_id)
+        permissions = await self.get_command_permissions(guild_id, connection=connection)
+        return StarEligibility(guild_id, frozenset(r[0] for r in records), permissions, self.bot.blacklist)
+
     async def bot_check(self, ctx):
         if ctx.guild is None:
             return True
@@ -256,6 +298,7 @@ class Config(commands.Cog):
 
                 # invalidate the cache for this guild
                 self.is_plonked.invalidate_containing(f'{ctx.guild.id!r}:')
+                self.get_star_eligibility.invalidate(self, ctx.guild.id)
 
     async def cog_command_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
@@ -287,6 +330,7 @@ class Config(commands.Cog):
 
             # invalidate the cache for this guild
             self.is_plonked.invalidate_containing(f'{ctx.guild.id!r}:')
+            self.get_star_eligibility.invalidate(self, ctx.guild.id)
         else:
             await self._bulk_ignore_entries(ctx, entities)
 
@@ -304,7 +348,7 @@ class Config(commands.Cog):
         query = "SELECT entity_id FROM plonks WHERE guild_id=$1;"
 
         guild = ctx.guild
-        records = await ctx.db.fetch(query, guild.id)
+        records = await ctx.read_db.fetch(query, guild.id)
 
         if len(records) == 0:
             return await ctx.send('I am not ignoring anything here.')
@@ -343,6 +387,7 @@ class Config(commands.Cog):
         query = "DELETE FROM plonks WHERE guild_id=$1;"
         await ctx.db.execute(query, ctx.guild.id)
         self.is_plonked.invalidate_containing(f'{ctx.guild.id!r}:')
+        self.get_star_eligibility.invalidate(self, ctx.guild.id)
         await ctx.send('Successfully cleared all ignores.')
 
     @config.group(pass_context=True, invoke_without_command=True, aliases=['unplonk'])
@@ -364,6 +409,7 @@ class Config(commands.Cog):
             await ctx.db.execute(query, ctx.guild.id, entities)
 
         self.is_plonked.invalidate_containing(f'{ctx.guild.id!r}:')
+        self.get_star_eligibility.invalidate(self, ctx.guild.id)
         await ctx.send(ctx.tick(True))
 
     @unignore.command(name='all')
@@ -387,6 +433,7 @@ class Config(commands.Cog):
     async def command_toggle(self, connection, guild_id, channel_id, name, *, whitelist=True):
         # clear the cache
         self.get_command_permissions.invalidate(self, guild_id)
+        self.get_star_eligibility.invalidate(self, guild_id)
 
         if channel_id is None:
             subcheck = 'channel_id IS NULL'
@@ -1,5 +1,5 @@
 from discord.ext import commands, tasks
-from .utils import checks, db, time, cache
+from .utils import checks, db, time, cache, broadcast
 from .utils.formats import plural
 from collections import Counter, defaultdict
 from inspect import cleandoc
@@ -331,23 +331,26 @@ class Mod(commands.Cog):
     @tasks.loop(seconds=10.0)
     async def bulk_send_messages(self):
         async with self._batch_message_lock:
-            for ((guild_id, channel_id), messages) in self.message_batches.items():
-                guild = self.bot.get_guild(guild_id)
-                channel = guild and guild.get_channel(channel_id)
-                if channel is None:
-                    continue
+            batches = self.message_batches
+            self.message_batches = defaultdict(list)
 
-                paginator = commands.Paginator(suffix='', prefix='')
-                for message in messages:
-                    paginator.add_line(message)
+        to_send = []
+        for ((guild_id, channel_id), messages) in batches.items():
+            guild = self.bot.get_guild(guild_id)
+            channel = guild and guild.get_channel(channel_id)
+            if channel is None:
+                continue
 
-                for page in paginator.pages:
-                    try:
-                        await channel.send(page)
-                    except discord.HTTPException:
-                        pass
+            paginator = commands.Paginator(suffix='', prefix='')
+            for message in messages:
+                paginator.add_line(message)
 
-            self.message_batches.clear()
+            to_send.extend((channel, page) for page in paginator.pages)
+
+        if to_send:
+            result = await broadcast.broadcast(to_send)
+            if result.failed:
+                log.info('Failed to send %s/%s batched mod messages', result.failed, result.total)
 
     @cache.cache()
     async def get_guild_config(self, guild_id):
@@ -788,6 +791,7 @@ class Mod(commands.Cog):
 
         `--channel` or `-c`: Channel to search for message history.
         `--reason` or `-r`: The reason for the ban.
+        `--duration` or `-d`: Unban the members after this long, e.g. 30d or "until thursday at 3PM".
         `--regex`: Regex that usernames must match.
         `--created`: Matches users whose accounts were created less than specified minutes ago.
         `--joined`: Matches users that joined less than specified minutes ago.
@@ -825,6 +829,7 @@ class Mod(commands.Cog):
         parser = Arguments(add_help=False, allow_abbrev=False)
         parser.add_argument('--channel', '-c')
         parser.add_argument('--reason', '-r')
+        parser.add_argument('--duration', '-d')
         parser.add_argument('--search', type=int, default=100)
         parser.add_argument('--regex')
         parser.add_argument('--no-avatar', action='store_true')
@@ -947,20 +952,42 @@ class Mod(commands.Cog):
         else:
             reason = await ActionReason().convert(ctx, args.reason)
 
+        duration = None
+        if args.duration:
+            try:
+                duration = time.FutureTime(args.duration, now=ctx.message.created_at)
+            except commands.BadArgument as e:
+                return await ctx.send(f'Invalid time passed to `--duration`: {e}')
+
+            reminder = self.bot.get_cog('Reminder')
+            if reminder is None:
+                return await ctx.send('Sorry, temporary bans are currently unavailable. Try again later?')
+
         confirm = await ctx.prompt(f'This will ban **{plural(len(members)):member}**. Are you sure?')
         if not confirm:
             return await ctx.send('Aborting.')
 
-        count = 0
+        banned = []
         for member in members:
             try:
                 await ctx.guild.ban(member, reason=reason)
             except discord.HTTPException:
                 pass
             else:
-                count += 1
+                banned.append(member.id)
+
+        if duration is None:
+            return await ctx.send(f'Banned {len(banned)}/{len(members)}')
+
+        # one timer per member but only a single query for all of them
+        await reminder.create_timers(duration.dt, 'tempban', [(ctx.guild.id, ctx.author.id, member_id) for member_id in banned],
+                                     connection=ctx.db,
+                                     created=ctx.message.created_at,
+                                     author_id=ctx.author.id,
+                                     guild_id=ctx.guild.id)
 
-        await ctx.send(f'Banned {count}/{len(members)}')
+        delta = time.human_timedelta(duration.dt, source=ctx.message.created_at)
+        await ctx.send(f'Banned {len(banned)}/{len(members)} for {delta}')
 
     @commands.command()
     @commands.guild_only()
@@ -1039,7 +1066,9 @@ class Mod(commands.Cog):
                                                                     ctx.author.id,
                                                                     member.id,
                                                                     connection=ctx.db,
-                                                                    created=ctx.message.created_at)
+                                                                    created=ctx.message.created_at,
+                                                                    author_id=ctx.author.id,
+                                                                    guild_id=ctx.guild.id)
         await ctx.send(f'Banned {member} for {time.human_timedelta(duration.dt, source=timer.created_at)}.')
 
     @commands.Cog.listener()
@@ -1538,7 +1567,9 @@ class Mod(commands.Cog):
                                                                      ctx.author.id,
                                                                      member.id,
                                                                      role_id,
-                                                                     created=ctx.message.created_at)
+                                                                     created=ctx.message.created_at,
+                                                                     author_id=ctx.author.id,
+                                                                     guild_id=ctx.guild.id)
         delta = time.human_timedelta(duration.dt, source=timer.created_at)
         await ctx.send(f'Muted {discord.utils.escape_mentions(str(member))} for {delta}.')
 
@@ -1815,7 +1846,9 @@ class Mod(commands.Cog):
                                                                      ctx.author.id,
                                                                      ctx.author.id,
                                                                      role_id,
-                                                                     created=created_at)
+                                                                     created=created_at,
+                                                                     author_id=ctx.author.id,
+                                                                     guild_id=ctx.guild.id)
 
         await ctx.send(f'\N{OK HAND SIGN} Muted for {delta}. Be sure not to bother anyone about it.')
 
@@ -1,10 +1,12 @@
-from .utils import checks, db, time
+from .utils import checks, db, time, formats, metrics
 from discord.ext import commands
 import discord
 import asyncio
 import asyncpg
 import datetime
+import heapq
 import io
+import itertools
 import textwrap
 
 class Reminders(db.Table):
@@ -15,8 +17,30 @@ class Reminders(db.Table):
     event = db.Column(db.String)
     extra = db.Column(db.JSON, default="'{}'::jsonb")
 
+    # who set the timer (the reminder owner, or the moderator) and where,
+    # older timers only had these inside of extra. Anything that isn't an ID
+    # is left NULL instead of failing the whole migration.
+    author_id = db.Column(db.Integer(big=True),
+                          backfill="CASE WHEN extra #>> '{args,1}' ~ '^[0-9]+$' "
+                                   "THEN (extra #>> '{args,1}')::bigint END")
+    channel_id = db.Column(db.Integer(big=True),
+                           backfill="CASE WHEN event IN ('reminder', 'tempblock') AND extra #>> '{args,2}' ~ '^[0-9]+$' "
+                                    "THEN (extra #>> '{args,2}')::bigint END")
+
+    # the guild the timer acts on, so that a cluster only claims the timers
+    # of guilds on its own shards. NULL (DMs, older reminders) is anyone's.
+    guild_id = db.Column(db.Integer(big=True),
+                         backfill="CASE WHEN event IN ('tempban', 'tempmute', 'tempblock') "
+                                  "AND extra #>> '{args,0}' ~ '^[0-9]+$' "
+                                  "THEN (extra #>> '{args,0}')::bigint END")
+
+    # the reminder list/delete/clear commands look up by event and author,
+    # this replaces the older index on the (extra #>> '{args,1}') expression
+    event_author = db.Index('event', 'author_id', 'expires')
+
 class Timer:
-    __slots__ = frozenset(('args', 'kwargs', 'event', 'id', 'created_at', 'expires'))
+    __slots__ = frozenset(('args', 'kwargs', 'event', 'id', 'created_at', 'expires', 'author_id', 'channel_id',
+                           'guild_id'))
 
     def __init__(self, *, record):
         self.id = record['id']
@@ -27,15 +51,21 @@ class Timer:
         self.event = record['event']
         self.created_at = record['created']
         self.expires = record['expires']
+        self.author_id = record['author_id']
+        self.channel_id = record['channel_id']
+        self.guild_id = record['guild_id']
 
     @classmethod
-    def temporary(cls, *, expires, created, event, args, kwargs):
+    def temporary(cls, *, expires, created, event, args, kwargs, author_id=None, channel_id=None, guild_id=None):
         pseudo = {
             'id': None,
             'extra': { 'args': args, 'kwargs': kwargs },
             'event': event,
             'created': created,
-            'expires': expires
+            'expires': expires,
+            'author_id': author_id,
+            'channel_id': channel_id,
+            'guild_id': guild_id
         }
         return cls(record=pseudo)
 
@@ -58,74 +88,242 @@ class Timer:
 class Reminder(commands.Cog):
     """Reminders to do something."""
 
+    # Timers expiring within this window get loaded into memory, up to
+    # preload_limit of them at a time.
+    preload_window = datetime.timedelta(minutes=30)
+    preload_limit = 1000
+
+    # How many due timers get claimed per query.
+    claim_batch_size = 100
+
     def __init__(self, bot):
         self.bot = bot
         self._have_data = asyncio.Event()
-        self._current_timer = None
+
+        # A min heap of (expires, sequence, timer) for every timer that is
+        # due before _loaded_until. Removing a timer only takes it out of
+        # _scheduled, the heap entry is skipped when it comes up.
+        self._heap = []
+        self._scheduled = {}
+        self._sequence = itertools.count()
+        self._loaded_until = None
+
+        # Short timers share the heap but have no row in the database
+        # unless persist_short_timers is set in the config.
+        self._pending_short = 0
+        self.persist_short_timers = getattr(bot.config, 'persist_short_timers', False)
+
+        # event: Histogram of how late its timers fired, in seconds
+        self.lateness = {}
+
         self._task = bot.loop.create_task(self.dispatch_timers())
 
     def cog_unload(self):
         self._task.cancel()
 
+        # short timers only live in memory, so they'd be gone after a reload
+        timers = [timer for _, _, timer in self._heap if timer.id is None]
+        if timers:
+            self.bot.loop.create_task(self.persist_timers(timers))
+
     async def cog_command_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
             await ctx.send(error)
         if isinstance(error, commands.TooManyArguments):
             await ctx.send(f'You called the {ctx.command.name} command with too many arguments.')
 
-    async def get_active_timer(self, *, connection=None, days=7):
-        query = "SELECT * FROM reminders WHERE expires < (CURRENT_DATE + $1::interval) ORDER BY expires LIMIT 1;"
+    def schedule_timer(self, timer):
+        """Puts a timer that is in the database into the in-memory schedule."""
+        if timer.id in self._scheduled:
+            return
+
+        self._scheduled[timer.id] = timer
+        heapq.heappush(self._heap, (timer.expires, next(self._sequence), timer))
+
+        # wake the dispatcher up if this is the next timer to fire
+        if self._heap[0][2] is timer:
+            self._have_data.set()
+
+    def schedule_short_timer(self, timer):
+        """Puts a timer that only lives in memory into the schedule."""
+        self._pending_short += 1
+        heapq.heappush(self._heap, (timer.expires, next(self._sequence), timer))
+        if self._heap[0][2] is timer:
+            self._have_data.set()
+
+    async def persist_timers(self, timers, *, connection=None):
+        """Writes timers that only lived in memory to the database in one query.
+
+        If the cog was reloaded then the new instance schedules them
+        right away, since they're due too soon for its next load.
+        """
+        query = """INSERT INTO reminders (event, extra, expires, created, author_id, channel_id, guild_id)
+                   SELECT x.event, jsonb_build_object('args', x.args, 'kwargs', x.kwargs),
+                          x.expires, x.created, x.author_id, x.channel_id, x.guild_id
+                   FROM jsonb_to_recordset($1::jsonb)
+                   AS x(event text, args jsonb, kwargs jsonb, expires timestamp, created timestamp,
+                        author_id bigint, channel_id bigint, guild_id bigint)
+                   RETURNING *;
+                """
+
+        rows = [
+            {
+                'event': timer.event,
+                'args': timer.args,
+                'kwargs': timer.kwargs,
+                'expires': timer.expires.isoformat(),
+                'created': timer.created_at.isoformat(),
+                'author_id': timer.author_id,
+                'channel_id': timer.channel_id,
+                'guild_id': timer.guild_id,
+            }
+            for timer in timers
+        ]
+
         con = connection or self.bot.pool
+        records = await con.fetch(query, rows)
+
+        cog = self.bot.get_cog('Reminder')
+        if cog is not None and cog is not self:
+            for record in records:
+                cog.schedule_timer(Timer(record=record))
+
+    def unschedule_timer(self, timer_id):
+        self._scheduled.pop(timer_id, None)
 
-        record = await con.fetchrow(query, datetime.timedelta(days=days))
-        return Timer(record=record) if record else None
+    def owned_shards(self):
+        """The shard IDs and count whose guilds' timers are handled here.
+
+        The shard IDs are ``None`` when this process runs every shard.
+        """
+        shard_ids = getattr(self.bot, 'shard_ids', None)
+        shard_count = getattr(self.bot, 'shard_count', None) or 1
+        return (None if shard_ids is None else list(shard_ids)), shard_count
 
-    async def wait_for_active_timers(self, *, connection=None, days=7):
-        async with db.MaybeAcquire(connection=connection, pool=self.bot.pool) as con:
-            timer = await self.get_active_timer(connection=con, days=days)
-            if timer is not None:
-                self._have_data.set()
-                return timer
+    async def load_timers(self, now, *, connection=None):
+        query = """SELECT *
+                   FROM reminders
+                   WHERE expires <= $1
+                   AND ($3::int[] IS NULL OR guild_id IS NULL OR (guild_id >> 22) % $4 = ANY($3::int[]))
+                   ORDER BY expires
+                   LIMIT $2;
+                """
+        con = connection or self.bot.pool
 
-            self._have_data.clear()
-            self._current_timer = None
-            await self._have_data.wait()
-            return await self.get_active_timer(connection=con, days=days)
+        until = now + self.preload_window
+        records = await con.fetch(query, until, self.preload_limit, *self.owned_shards())
+        for record in records:
+            self.schedule_timer(Timer(record=record))
+
+        if len(records) == self.preload_limit:
+            # there's more in the window than we're willing to hold,
+            # so only what we've loaded so far counts as loaded
+            until = records[-1]['expires']
+
+        self._loaded_until = until
+
+    def pop_due_timers(self, now):
+        heap = self._heap
+        due = []
+        while heap and heap[0][0] <= now:
+            _, _, timer = heapq.heappop(heap)
+            if timer.id is None:
+                self._pending_short -= 1
+                due.append(timer)
+            # skip the entries of timers that were deleted
+            elif self._scheduled.get(timer.id) is timer:
+                del self._scheduled[timer.id]
+                due.append(timer)
+        return due
+
+    async def claim_timers(self, now, *, connection=None):
+        """Claims and dispatches every timer that is due by ``now``.
+
+        Claiming a timer deletes it, and rows locked by a concurrent claim
+        are skipped, so when several processes share the table each timer
+        is dispatched by at most one of them. Only timers of guilds on this
+        process's shards (or without a guild) are claimed, since the other
+        clusters can't act on the rest.
+
+        Dispatching is at most once: a process dying between the claim and
+        the dispatch loses those timers rather than firing them twice.
+        """
+        query = """DELETE FROM reminders
+                   WHERE id IN (
+                       SELECT id
+                       FROM reminders
+                       WHERE expires <= $1
+                       AND ($3::int[] IS NULL OR guild_id IS NULL OR (guild_id >> 22) % $4 = ANY($3::int[]))
+                       ORDER BY expires
+                       LIMIT $2
+                       FOR UPDATE SKIP LOCKED
+                   )
+                   RETURNING *;
+                """
 
-    async def call_timer(self, timer):
-        # delete the timer
-        query = "DELETE FROM reminders WHERE id=$1;"
-        await self.bot.pool.execute(query, timer.id)
+        con = connection or self.bot.pool
+        shard_ids, shard_count = self.owned_shards()
+        while True:
+            records = await con.fetch(query, now, self.claim_batch_size, shard_ids, shard_count)
+            for record in records:
+                timer = Timer(record=record)
+                self.unschedule_timer(timer.id)
+                self.dispatch_timer(timer)
+
+            if len(records) < self.claim_batch_size:
+                return
+
+    def dispatch_timer(self, timer):
+        late = (datetime.datetime.utcnow() - timer.expires).total_seconds()
+        try:
+            histogram = self.lateness[timer.event]
+        except KeyError:
+            histogram = self.lateness[timer.event] = metrics.Histogram()
+        histogram.add(max(late, 0.0))
 
-        # dispatch the event
         event_name = f'{timer.event}_timer_complete'
         self.bot.dispatch(event_name, timer)
 
     async def dispatch_timers(self):
         try:
             while not self.bot.is_closed():
-                # can only asyncio.sleep for up to ~48 days reliably
-                # so we're gonna cap it off at 40 days
-                # see: http://bugs.python.org/issue20493
-                timer = self._current_timer = await self.wait_for_active_timers(days=40)
                 now = datetime.datetime.utcnow()
-
-                if timer.expires >= now:
-                    to_sleep = (timer.expires - now).total_seconds()
-                    await asyncio.sleep(to_sleep)
-
-                await self.call_timer(timer)
+                if self._loaded_until is None or now >= self._loaded_until:
+                    await self.load_timers(now)
+
+                # for timers in the database the heap only says when to look,
+                # whatever is actually due gets claimed from the database.
+                # Some of it might already have been claimed by another process.
+                timers = self.pop_due_timers(now)
+                if timers:
+                    claim = False
+                    for timer in timers:
+                        if timer.id is None:
+                            self.dispatch_timer(timer)
+                        else:
+                            claim = True
+
+                    if claim:
+                        await self.claim_timers(now)
+                    continue
+
+                wake_at = self._loaded_until
+                if self._heap:
+                    wake_at = min(wake_at, self._heap[0][0])
+
+                self._have_data.clear()
+                to_sleep = (wake_at - now).total_seconds()
+                try:
+                    await asyncio.wait_for(self._have_data.wait(), timeout=max(to_sleep, 0))
+                except asyncio.TimeoutError:
+                    pass
         except asyncio.CancelledError:
             pass
         except (OSError, discord.ConnectionClosed, asyncpg.PostgresConnectionError):
+            self._loaded_until = None
             self._task.cancel()
             self._task = self.bot.loop.create_task(self.dispatch_timers())
 
-    async def short_timer_optimisation(self, seconds, timer):
-        await asyncio.sleep(seconds)
-        event_name = f'{timer.event}_timer_complete'
-        self.bot.dispatch(event_name, timer)
-
     async def create_timer(self, *args, **kwargs):
         r"""Creates a timer.
 
@@ -146,6 +344,15 @@ class Reminder(commands.Cog):
         created: datetime.datetime
             Special keyword-only argument to use as the creation time.
             Should make the timedeltas a bit more consistent.
+        author_id: int
+            Special keyword-only argument for who set the timer.
+            Used to look up someone's timers.
+        channel_id: int
+            Special keyword-only argument for the channel the timer
+            was set in.
+        guild_id: int
+            Special keyword-only argument for the guild the timer acts on.
+            Only the cluster running that guild's shard dispatches it.
 
         Note
         ------
@@ -167,32 +374,95 @@ class Reminder(commands.Cog):
         except KeyError:
             now = datetime.datetime.utcnow()
 
-        timer = Timer.temporary(event=event, args=args, kwargs=kwargs, expires=when, created=now)
+        author_id = kwargs.pop('author_id', None)
+        channel_id = kwargs.pop('channel_id', None)
+        guild_id = kwargs.pop('guild_id', None)
+
+        timer = Timer.temporary(event=event, args=args, kwargs=kwargs, expires=when, created=now,
+                                author_id=author_id, channel_id=channel_id, guild_id=guild_id)
         delta = (when - now).total_seconds()
-        if delta <= 60:
-            # a shortcut for small timers
-            self.bot.loop.create_task(self.short_timer_optimisation(delta, timer))
+        if delta <= 60 and not self.persist_short_timers:
+            # a shortcut for small timers, they aren't worth a round trip
+            # but they don't survive a restart either
+            self.schedule_short_timer(timer)
             return timer
 
-        query = """INSERT INTO reminders (event, extra, expires, created)
-                   VALUES ($1, $2::jsonb, $3, $4)
+        query = """INSERT INTO reminders (event, extra, expires, created, author_id, channel_id, guild_id)
+                   VALUES ($1, $2::jsonb, $3, $4, $5, $6, $7)
                    RETURNING id;
                 """
 
-        row = await connection.fetchval(query, event, { 'args': args, 'kwargs': kwargs }, when, now)
+        timer.id = await connection.fetchval(query, event, { 'args': args, 'kwargs': kwargs }, when, now,
+                                             author_id, channel_id, guild_id)
 
-        # only set the data check if it can be waited on
-        if delta <= (86400 * 40): # 40 days
-            self._have_data.set()
-
-        # check if this timer is earlier than our currently run timer
-        if self._current_timer and when < self._current_timer.expires:
-            # cancel the task and re-run it
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self.dispatch_timers())
+        # anything further out than that gets picked up by a later load
+        if when <= datetime.datetime.utcnow() + self.preload_window:
+            self.schedule_timer(timer)
 
         return timer
 
+    async def create_timers(self, when, event, arguments, **kwargs):
+        r"""Creates many timers for the same event and time at once.
+
+        This is a single query no matter how many timers there are,
+        e.g. for undoing a mass moderation action later.
+
+        Parameters
+        -----------
+        when: datetime.datetime
+            When the timers should fire.
+        event: str
+            The name of the event to trigger.
+            Will transform to 'on_{event}_timer_complete'.
+        arguments: Iterable[Sequence]
+            The arguments to pass to the event, one sequence per timer.
+        \*\*kwargs
+            Keyword arguments to pass to the event, shared by every timer.
+            The special keyword-only arguments of :meth:`create_timer`
+            are supported as well.
+
+        Returns
+        --------
+        List[:class:`Timer`]
+        """
+
+        connection = kwargs.pop('connection', None) or self.bot.pool
+        now = kwargs.pop('created', None) or datetime.datetime.utcnow()
+        author_id = kwargs.pop('author_id', None)
+        channel_id = kwargs.pop('channel_id', None)
+        guild_id = kwargs.pop('guild_id', None)
+
+        arguments = [list(args) for args in arguments]
+        if not arguments:
+            return []
+
+        delta = (when - now).total_seconds()
+        if delta <= 60 and not self.persist_short_timers:
+            timers = [
+                Timer.temporary(event=event, args=args, kwargs=kwargs, expires=when, created=now,
+                                author_id=author_id, channel_id=channel_id, guild_id=guild_id)
+                for args in arguments
+            ]
+            for timer in timers:
+                self.schedule_short_timer(timer)
+            return timers
+
+        query = """INSERT INTO reminders (event, extra, expires, created, author_id, channel_id, guild_id)
+                   SELECT $1, jsonb_build_object('args', x.args, 'kwargs', $2::jsonb), $3, $4, $5, $6, $7
+                   FROM jsonb_to_recordset($8::jsonb) AS x(args jsonb)
+                   RETURNING *;
+                """
+
+        records = await connection.fetch(query, event, kwargs, when, now, author_id, channel_id, guild_id,
+                                         [{ 'args': args } for args in arguments])
+
+        timers = [Timer(record=record) for record in records]
+        if when <= datetime.datetime.utcnow() + self.preload_window:
+            for timer in timers:
+                self.schedule_timer(timer)
+
+        return timers
+
     @staticmethod
     def mention(*, id=None, name=None):
         if name is not None:
@@ -227,22 +497,48 @@ class Reminder(commands.Cog):
                                                              when.arg,
                                                              connection=ctx.db,
                                                              created=ctx.message.created_at,
+                                                             author_id=ctx.author.id,
+                                                             channel_id=ctx.channel.id,
+                                                             guild_id=ctx.guild and ctx.guild.id,
                                                              message_id=ctx.message.id)
         delta = time.human_timedelta(when.dt, source=timer.created_at)
         await ctx.send(f'Alright {self.message_mention(ctx.message)}, in {delta}: {when.arg}')
 
+    @reminder.command(name='stats', hidden=True)
+    @commands.is_owner()
+    async def reminder_stats(self, ctx):
+        """Shows the state of the timer scheduler."""
+
+        loaded_until = self._loaded_until
+        loaded_until = 'nothing yet' if loaded_until is None else f'{loaded_until:%Y-%m-%d %H:%M:%S} UTC'
+        next_timer = f'{self._heap[0][0]:%Y-%m-%d %H:%M:%S} UTC' if self._heap else 'none'
+
+        output = [
+            f'Scheduled timers: {len(self._scheduled)}',
+            f'Pending short timers: {self._pending_short}',
+            f'Heap entries: {len(self._heap)}',
+            f'Next wake up: {next_timer}',
+            f'Loaded until: {loaded_until}',
+            f'Short timers persisted: {self.persist_short_timers}',
+        ]
+
+        for event, histogram in sorted(self.lateness.items()):
+            output.append(f'Lateness ({event}): {histogram.summary()}')
+
+        await ctx.send('```\n' + '\n'.join(output) + '\n```')
+
     @reminder.command(name='list', ignore_extra=False)
     async def reminder_list(self, ctx):
         """Shows the 10 latest currently running reminders."""
         query = """SELECT id, expires, created, extra #>> '{args,3}'
                    FROM reminders
                    WHERE event = 'reminder'
-                   AND extra #>> '{args,1}' = $1
+                   AND author_id = $1
                    ORDER BY expires
                    LIMIT 10;
                 """
 
-        records = await ctx.db.fetch(query, str(ctx.author.id))
+        records = await ctx.read_db.fetch(query, ctx.author.id)
 
         if len(records) == 0:
             return await ctx.send('No currently running reminders.')
@@ -277,19 +573,14 @@ class Reminder(commands.Cog):
             DELETE FROM reminders
             WHERE id=$1
             AND event = 'reminder'
-            AND extra #>> '{args,1}' = $2;
+            AND author_id = $2;
         """
 
-        status = await ctx.db.execute(query, id, str(ctx.author.id))
+        status = await ctx.db.execute(query, id, ctx.author.id)
         if status == 'DELETE 0':
             return await ctx.send('Could not delete any reminders with that ID.')
 
-        # if the current timer is being deleted
-        if self._current_timer and self._current_timer.id == id:
-            # cancel the task and re-run it
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self.dispatch_timers())
-
+        self.unschedule_timer(id)
         await ctx.send('Successfully deleted reminder.')
 
     @reminder.command(name='clear', ignore_extra=False)
@@ -301,10 +592,10 @@ class Reminder(commands.Cog):
         query = """SELECT COUNT(*)
                    FROM reminders
                    WHERE event = 'reminder'
-                   AND extra #>> '{args,0}' = $1;
+                   AND author_id = $1;
                 """
 
-        author_id = str(ctx.author.id)
+        author_id = ctx.author.id
         total = await ctx.db.fetchrow(query, author_id)
         total = total[0]
         if total == 0:
@@ -314,8 +605,11 @@ class Reminder(commands.Cog):
         if not confirm:
             return await ctx.send('Aborting')
 
-        query = """DELETE FROM reminders WHERE event = 'reminder' AND extra #>> '{args,0}' = $1;"""
-        await ctx.db.execute(query, author_id)
+        query = """DELETE FROM reminders WHERE event = 'reminder' AND author_id = $1 RETURNING id;"""
+        records = await ctx.db.fetch(query, author_id)
+        for record in records:
+            self.unschedule_timer(record['id'])
+
         await ctx.send(f'Successfully deleted {formats.plural(total):reminder}.')
 
     @commands.Cog.listener()
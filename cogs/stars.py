@@ -1,5 +1,5 @@
 from discord.ext import commands, tasks
-from .utils import checks, db, cache
+from .utils import checks, db, cache, broadcast
 from .utils.formats import plural, human_join
 from .utils.paginator import Pages
 from collections import Counter, defaultdict
@@ -13,6 +13,7 @@ import asyncio
 import asyncpg
 import logging
 import weakref
+import copy
 import re
 
 log = logging.getLogger(__name__)
@@ -57,16 +58,229 @@ class StarboardEntry(db.Table, table_name='starboard_entries'):
     author_id = db.Column(db.Integer(big=True))
     guild_id = db.Column(db.ForeignKey('starboard', 'id', sql_type=db.Integer(big=True)), index=True, nullable=False)
 
+    # kept in sync with the starrers rows by the star and unstar queries
+    star_count = db.Column(db.Integer, default=0, nullable=False,
+                           backfill='(SELECT COUNT(*) FROM starrers WHERE starrers.entry_id = starboard_entries.id)')
+
+    # for the member stats
+    guild_author = db.Index('guild_id', 'author_id')
+    # for star random and star clean, which only care about posted entries
+    guild_posted = db.Index('guild_id', 'bot_message_id', where='bot_message_id IS NOT NULL')
+    # for the top starred posts
+    guild_top = db.Index('guild_id', 'star_count', where='bot_message_id IS NOT NULL')
+
 class Starrers(db.Table):
     id = db.PrimaryKeyColumn()
     author_id = db.Column(db.Integer(big=True), nullable=False)
     entry_id = db.Column(db.ForeignKey('starboard_entries', 'id'), index=True, nullable=False)
 
-    @classmethod
-    def create_table(cls, *, exists_ok=True):
-        statement = super().create_table(exists_ok=exists_ok)
-        sql = "CREATE UNIQUE INDEX IF NOT EXISTS starrers_uniq_idx ON starrers (author_id, entry_id);"
-        return statement + '\n' + sql
+    uniq = db.Index('author_id', 'entry_id', unique=True)
+
+def _star_emoji(stars):
+    if 5 > stars >= 0:
+        return '\N{WHITE MEDIUM STAR}'
+    elif 10 > stars >= 5:
+        return '\N{GLOWING STAR}'
+    elif 25 > stars >= 10:
+        return '\N{DIZZY SYMBOL}'
+    else:
+        return '\N{SPARKLES}'
+
+def _star_gradient_colour(stars):
+    # We define as 13 stars to be 100% of the star gradient (half of the 26 emoji threshold)
+    # So X / 13 will clamp to our percentage,
+    # We start out with 0xfffdf7 for the beginning colour
+    # Gradually evolving into 0xffc20c
+    # rgb values are (255, 253, 247) -> (255, 194, 12)
+    # To create the gradient, we use a linear interpolation formula
+    # Which for reference is X = X_1 * p + X_2 * (1 - p)
+    p = stars / 13
+    if p > 1.0:
+        p = 1.0
+
+    red = 255
+    green = int((194 * p) + (253 * (1 - p)))
+    blue = int((12 * p) + (247 * (1 - p)))
+    return (red << 16) + (green << 8) + blue
+
+# indexed by star count, anything past the end uses the last entry
+STAR_EMOJI = tuple(_star_emoji(stars) for stars in range(26))
+STAR_COLOURS = tuple(_star_gradient_colour(stars) for stars in range(14))
+
+class MessageSnapshot:
+    """The parts of a message the starboard needs.
+
+    Holding on to a :class:`discord.Message` keeps its author, channel,
+    mentions and reactions alive, so the message cache stores these
+    instead. Editing and deleting goes through the HTTP client directly.
+    """
+
+    __slots__ = ('id', 'channel_id', 'guild_id', 'type', 'author_id', 'author_name', 'author_avatar',
+                 'content', 'attachments', 'embeds', 'created_at', 'template', '_http')
+
+    def __init__(self, message):
+        self.id = message.id
+        self.channel_id = message.channel.id
+        self.guild_id = message.guild.id
+        self.type = message.type
+        self.author_id = message.author.id
+        self.author_name = message.author.display_name
+        self.author_avatar = str(message.author.avatar_url_as(format='png'))
+        self.content = message.content
+        # (filename, url) pairs
+        self.attachments = [(a.filename, a.url) for a in message.attachments]
+        self.embeds = message.embeds
+        self.created_at = message.created_at
+        # the parts of its starboard post that don't depend on the star count
+        self.template = None
+        self._http = message._state.http
+
+    def __repr__(self):
+        return f'<MessageSnapshot id={self.id} channel_id={self.channel_id}>'
+
+    @property
+    def jump_url(self):
+        return f'https://discordapp.com/channels/{self.guild_id}/{self.channel_id}/{self.id}'
+
+    async def edit(self, *, content, embed):
+        await self._http.edit_message(self.channel_id, self.id, content=content, embed=embed.to_dict())
+        self.content = content
+        self.embeds = [embed]
+
+    async def delete(self):
+        await self._http.delete_message(self.channel_id, self.id)
+
+class PendingEdit:
+    __slots__ = ('message', 'pending', 'failures', 'task')
+
+    def __init__(self, message, content, embed):
+        self.message = message
+        # the latest (content, embed) that hasn't been sent yet,
+        # it's only cleared once the edit went through
+        self.pending = (content, embed)
+        # how many times in a row the edit failed
+        self.failures = 0
+        self.task = None
+
+class PostSampler:
+    """The starboard post IDs of a guild, for picking one at random.
+
+    Removal swaps the last ID into the freed slot so that adding,
+    removing and picking are all O(1).
+    """
+    __slots__ = ('ids', 'positions')
+
+    def __init__(self, ids):
+        self.ids = list(ids)
+        # message_id: index into ids
+        self.positions = { message_id: index for index, message_id in enumerate(self.ids) }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, message_id):
+        if message_id not in self.positions:
+            self.positions[message_id] = len(self.ids)
+            self.ids.append(message_id)
+
+    def discard(self, message_id):
+        try:
+            index = self.positions.pop(message_id)
+        except KeyError:
+            return
+
+        last = self.ids.pop()
+        if index < len(self.ids):
+            self.ids[index] = last
+            self.positions[last] = index
+
+    def choice(self):
+        return random.choice(self.ids) if self.ids else None
+
+class PostCount:
+    """How many starboard posts a guild has, when there's too many for a :class:`PostSampler`.
+
+    Random posts are then picked by skipping a random number of rows
+    of the guild_posted index, so it's kept up to date the same way.
+    """
+    __slots__ = ('count',)
+
+    def __init__(self, count):
+        self.count = count
+
+    def add(self, message_id):
+        self.count += 1
+
+    def discard(self, message_id):
+        self.count = max(self.count - 1, 0)
+
+class ReactionBatch:
+    __slots__ = ('guild_id', 'events', 'task')
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        # (channel_id, message_id, user_id): True if starred
+        self.events = {}
+        self.task = None
+
+    def add(self, channel_id, message_id, user_id, star):
+        key = (channel_id, message_id, user_id)
+        if self.events.get(key, star) is not star:
+            # starring then unstarring (or the other way around) is a no-op
+            del self.events[key]
+        else:
+            self.events[key] = star
+
+# The leaderboards are kept up to date by the star and unstar queries.
+# Anything else that deletes entries marks the guild for reconciling.
+
+class StarboardReceivers(db.Table, table_name='starboard_receivers'):
+    guild_id = db.Column(db.ForeignKey('starboard', 'id', sql_type=db.Integer(big=True)), primary_key=True)
+    author_id = db.Column(db.Integer(big=True), primary_key=True)
+    stars = db.Column(db.Integer, default=0, nullable=False)
+
+    leaderboard = db.Index('guild_id', 'stars')
+
+class StarboardGivers(db.Table, table_name='starboard_givers'):
+    guild_id = db.Column(db.ForeignKey('starboard', 'id', sql_type=db.Integer(big=True)), primary_key=True)
+    author_id = db.Column(db.Integer(big=True), primary_key=True)
+    stars = db.Column(db.Integer, default=0, nullable=False)
+
+    leaderboard = db.Index('guild_id', 'stars')
+
+class StarboardJobs(db.Table, table_name='starboard_jobs'):
+    id = db.PrimaryKeyColumn()
+
+    guild_id = db.Column(db.ForeignKey('starboard', 'id', sql_type=db.Integer(big=True)), nullable=False)
+    kind = db.Column(db.String, nullable=False)
+    created = db.Column(db.Datetime, default="now() at time zone 'utc'")
+
+    # who started it, and where progress gets reported
+    author_id = db.Column(db.Integer(big=True))
+    channel_id = db.Column(db.Integer(big=True))
+    progress_id = db.Column(db.Integer(big=True))
+
+    # the job's arguments and cursor, saved after every batch
+    state = db.Column(db.JSON, default="'{}'::jsonb")
+
+    # only one job of each kind runs per guild
+    uniq = db.Index('guild_id', 'kind', unique=True)
+
+class StarboardJob:
+    __slots__ = ('id', 'guild_id', 'kind', 'author_id', 'channel_id', 'progress_id', 'state', 'last_report')
+
+    def __init__(self, *, record):
+        self.id = record['id']
+        self.guild_id = record['guild_id']
+        self.kind = record['kind']
+        self.author_id = record['author_id']
+        self.channel_id = record['channel_id']
+        self.progress_id = record['progress_id']
+        self.state = record['state']
+        self.last_report = 0.0
+
+    def __repr__(self):
+        return f'<StarboardJob id={self.id} kind={self.kind} guild_id={self.guild_id}>'
 
 class StarboardConfig:
     __slots__ = ('bot', 'id', 'channel_id', 'threshold', 'locked', 'needs_migration', 'max_age')
@@ -107,26 +321,756 @@ class Stars(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
-        # cache message objects to save Discord some HTTP requests.
-        self._message_cache = {}
-        self.clean_message_cache.start()
+        # cache message snapshots to save Discord some HTTP requests.
+        self._message_cache = cache.LRUCache(10000, seconds=6 * 60 * 60)
 
         # if it's in this set,
         self._about_to_be_deleted = set()
 
+        # bot_message_id: PendingEdit
+        self._edits = {}
+
+        # guild_id: ReactionBatch
+        self._reaction_batches = {}
+
+        # (guild_id, message_id): (channel_id, message_id) of the starred message
+        self._entry_ids = cache.LRUCache(10000, seconds=24 * 60 * 60)
+
+        # guild_id: PostSampler, or PostCount if the guild has too many posts to keep
+        self._post_samplers = cache.LRUCache(64, seconds=60 * 60)
+
+        # guilds whose leaderboards need to be recomputed
+        self._dirty_leaderboards = set()
+        self.reconcile_leaderboards.start()
+
+        # job_id: asyncio.Task, unfinished jobs are resumed on load
+        self._jobs = {}
+        bot.loop.create_task(self.resume_jobs())
+
+        # message_id: asyncio.Lock, for starring and unstarring
         self._locks = weakref.WeakValueDictionary()
+        # guild_id: asyncio.Lock, for changing the starboard itself
+        self._guild_locks = weakref.WeakValueDictionary()
+        # guild_id: asyncio.Lock, so a guild's reaction batches are applied in order
+        self._flush_locks = weakref.WeakValueDictionary()
         self.spoilers = re.compile(r'\|\|(.+?)\|\|')
+        self.valid_post = re.compile(r'.+?<#(?P<channel_id>[0-9]{17,21})>\s*ID\:\s*(?P<message_id>[0-9]{17,21})')
+
+    # Starboard posts are edited at most once per this many seconds
+    edit_interval = 5.0
+    # how many times a failed edit is retried before it's dropped
+    edit_retries = 3
+    # how long star reactions are buffered before they're written
+    ingest_interval = 0.3
+    # guilds with more posts than this pick random posts from the index instead
+    sampler_limit = 100000
+    # how many entries a clean job handles at a time
+    clean_batch_size = 100
+    # delay between deleting posts too old to bulk delete
+    single_delete_interval = 1.0
+    # job progress is reported at most once per this many seconds
+    report_interval = 10.0
+    # how many starboard posts a migrate job edits at once
+    migrate_concurrency = 5
 
     def cog_unload(self):
-        self.clean_message_cache.cancel()
+        self.reconcile_leaderboards.cancel()
+        for task in self._jobs.values():
+            task.cancel()
+        self._jobs.clear()
+        # the posts would be stuck with stale counts otherwise
+        pending = []
+        for edit in self._edits.values():
+            edit.task.cancel()
+            if edit.pending is not None:
+                pending.append(edit)
+        self._edits.clear()
+        if pending:
+            self.bot.loop.create_task(self.flush_edits(pending))
 
     async def cog_command_error(self, ctx, error):
         if isinstance(error, StarError):
             await ctx.send(error)
 
-    @tasks.loop(hours=1.0)
-    async def clean_message_cache(self):
-        self._message_cache.clear()
+    def schedule_edit(self, message, content, embed):
+        """Edits a starboard post without hammering the rate limits.
+
+        The first edit goes out right away. Anything that comes in for the
+        same post within :attr:`edit_interval` of it only replaces what
+        the next edit says, so a burst of stars ends up as two edits.
+        """
+        edit = self._edits.get(message.id)
+        if edit is not None:
+            edit.pending = (content, embed)
+            return
+
+        edit = self._edits[message.id] = PendingEdit(message, content, embed)
+        edit.task = self.bot.loop.create_task(self._run_edits(edit))
+
+    def cancel_edit(self, message_id):
+        edit = self._edits.pop(message_id, None)
+        if edit is not None:
+            edit.task.cancel()
+
+    async def _run_edits(self, edit):
+        try:
+            while edit.pending is not None:
+                pending = edit.pending
+                content, embed = pending
+                try:
+                    await edit.message.edit(content=content, embed=embed)
+                except (discord.NotFound, discord.Forbidden):
+                    # the post is gone or we can't touch it anymore
+                    return
+                except discord.HTTPException as e:
+                    # keep the edit around and try again next interval
+                    edit.failures += 1
+                    if edit.failures <= self.edit_retries:
+                        await asyncio.sleep(self.edit_interval)
+                        continue
+
+                    log.warning('Giving up on editing starboard post ID %s: %s', edit.message.id, e)
+
+                edit.failures = 0
+                if edit.pending is pending:
+                    edit.pending = None
+                await asyncio.sleep(self.edit_interval)
+        finally:
+            if self._edits.get(edit.message.id) is edit:
+                del self._edits[edit.message.id]
+
+    async def flush_edits(self, edits):
+        """Sends the last pending edit of each post right away."""
+        for edit in edits:
+            content, embed = edit.pending
+            try:
+                await edit.message.edit(content=content, embed=embed)
+            except discord.HTTPException:
+                pass
+
+    def queue_reaction(self, channel, message_id, user_id, star):
+        batch = self._reaction_batches.get(channel.guild.id)
+        if batch is None:
+            batch = self._reaction_batches[channel.guild.id] = ReactionBatch(channel.guild.id)
+            batch.task = self.bot.loop.create_task(self._flush_reactions(batch))
+
+        batch.add(channel.id, message_id, user_id, star)
+
+    async def _flush_reactions(self, batch):
+        await asyncio.sleep(self.ingest_interval)
+        del self._reaction_batches[batch.guild_id]
+        if not batch.events:
+            return
+
+        # the next batch can start filling up while this one is still being
+        # applied, it has to wait so an unstar can't be overtaken by its star.
+        # the lock is taken before yielding so the batches queue up in order.
+        async with self.get_flush_lock(batch.guild_id):
+            guild = self.bot.get_guild(batch.guild_id)
+            if guild is None:
+                return
+
+            try:
+                await self.apply_reactions(guild, batch.events)
+            except Exception:
+                log.exception('Could not apply %s star reactions in guild ID %s', len(batch.events), guild.id)
+
+    async def apply_reactions(self, guild, events):
+        """Applies a burst of star reactions in one statement.
+
+        Every affected starboard post is rendered once afterwards,
+        no matter how many reactions it got.
+
+        Parameters
+        ------------
+        guild: :class:`Guild`
+            The guild the reactions happened in.
+        events: Dict[Tuple[int, int, int], bool]
+            Maps (channel_id, message_id, user_id) to whether it
+            was a star (True) or an unstar (False).
+        """
+
+        starboard = await self.get_starboard(guild.id)
+        starboard_channel = starboard.channel
+        if starboard_channel is None or starboard.locked:
+            return
+
+        if not starboard_channel.permissions_for(guild.me).send_messages:
+            return
+
+        config = self.bot.get_cog('Config')
+        if config:
+            eligibility = await config.get_star_eligibility(guild.id)
+            events = {
+                key: star
+                for key, star in events.items()
+                if eligibility.can_star(guild, key[2], key[0])
+            }
+
+        # reactions on starboard posts count for the original message
+        originals = {}
+        posts = []
+        for (channel_id, message_id, _) in events:
+            if channel_id == starboard_channel.id:
+                try:
+                    originals[message_id] = self._entry_ids[guild.id, message_id]
+                except KeyError:
+                    posts.append(message_id)
+
+        if posts:
+            query = """SELECT bot_message_id, channel_id, message_id
+                       FROM starboard_entries
+                       WHERE bot_message_id=ANY($1::bigint[]);
+                    """
+            records = await self.bot.pool.fetch(query, posts)
+            for bot_message_id, channel_id, message_id in records:
+                originals[bot_message_id] = self._entry_ids[guild.id, bot_message_id] = (channel_id, message_id)
+
+        # (message_id, user_id): [channel_id, star]
+        resolved = {}
+        for (channel_id, message_id, user_id), star in events.items():
+            if channel_id == starboard_channel.id:
+                try:
+                    channel_id, message_id = originals[message_id]
+                except KeyError:
+                    continue
+
+            key = (message_id, user_id)
+            previous = resolved.get(key)
+            if previous is not None and previous[1] is not star:
+                del resolved[key]
+            else:
+                resolved[key] = (channel_id, star)
+
+        # message_id: TextChannel
+        channels = {}
+        # message_id: MessageSnapshot, None if it can't be starred
+        messages = {}
+        rows = []
+        for (message_id, user_id), (channel_id, star) in resolved.items():
+            channel = guild.get_channel(channel_id)
+            if channel is None:
+                continue
+
+            author_id = None
+            if star:
+                if message_id not in messages:
+                    msg = await self.get_message(channel, message_id)
+                    try:
+                        self.check_starrable(starboard, channel, msg)
+                    except StarError:
+                        msg = None
+                    messages[message_id] = msg
+
+                msg = messages[message_id]
+                if msg is None:
+                    continue
+                author_id = msg.author_id
+
+            channels[message_id] = channel
+            rows.append({
+                'message_id': message_id,
+                'channel_id': channel_id,
+                'author_id': author_id,
+                'starrer_id': user_id,
+                'star': star,
+            })
+
+        if not rows:
+            return
+
+        query = """WITH events AS (
+                       SELECT *
+                       FROM jsonb_to_recordset($2::jsonb)
+                       AS x(message_id bigint, channel_id bigint, author_id bigint, starrer_id bigint, star boolean)
+                   ), existing AS (
+                       SELECT id, message_id, author_id
+                       FROM starboard_entries
+                       WHERE message_id IN (SELECT message_id FROM events)
+                   ), created AS (
+                       -- a fresh entry starts out with every star it got in this batch
+                       INSERT INTO starboard_entries AS entry (message_id, channel_id, guild_id, author_id, star_count)
+                       SELECT message_id, channel_id, $1, author_id, COUNT(*)
+                       FROM events
+                       WHERE star
+                       AND message_id NOT IN (SELECT message_id FROM existing)
+                       GROUP BY message_id, channel_id, author_id
+                       ON CONFLICT (message_id) DO NOTHING
+                       RETURNING entry.id, entry.message_id, entry.author_id, entry.star_count
+                   ), touched AS (
+                       SELECT id, message_id, author_id FROM existing
+                       UNION ALL
+                       SELECT id, message_id, author_id FROM created
+                   ), added AS (
+                       INSERT INTO starrers (author_id, entry_id)
+                       SELECT events.starrer_id, touched.id
+                       FROM events
+                       INNER JOIN touched ON touched.message_id = events.message_id
+                       WHERE events.star
+                       ON CONFLICT (author_id, entry_id) DO NOTHING
+                       RETURNING author_id, entry_id
+                   ), removed AS (
+                       DELETE FROM starrers USING events, existing
+                       WHERE NOT events.star
+                       AND existing.message_id = events.message_id
+                       AND starrers.entry_id = existing.id
+                       AND starrers.author_id = events.starrer_id
+                       RETURNING starrers.author_id, starrers.entry_id
+                   ), changes AS (
+                       SELECT author_id, entry_id, 1 AS delta FROM added
+                       UNION ALL
+                       SELECT author_id, entry_id, -1 FROM removed
+                   ), deltas AS (
+                       -- only the change is carried over, the count itself is read
+                       -- from the latest row so concurrent writers don't get lost
+                       SELECT entry_id AS id, SUM(delta) AS delta
+                       FROM changes
+                       WHERE entry_id IN (SELECT id FROM existing)
+                       GROUP BY entry_id
+                       HAVING SUM(delta) <> 0
+                   ), updated AS (
+                       UPDATE starboard_entries entry
+                       SET star_count = entry.star_count + deltas.delta
+                       FROM deltas
+                       WHERE entry.id = deltas.id
+                       AND entry.star_count + deltas.delta > 0
+                       RETURNING entry.message_id, entry.bot_message_id, entry.star_count
+                   ), dropped AS (
+                       DELETE FROM starboard_entries entry
+                       USING deltas
+                       WHERE entry.id = deltas.id
+                       AND entry.star_count + deltas.delta <= 0
+                       RETURNING entry.message_id, entry.bot_message_id
+                   ), receivers AS (
+                       INSERT INTO starboard_receivers AS r (guild_id, author_id, stars)
+                       SELECT $1, touched.author_id, SUM(changes.delta)
+                       FROM changes
+                       INNER JOIN touched ON touched.id = changes.entry_id
+                       WHERE touched.author_id IS NOT NULL
+                       GROUP BY touched.author_id
+                       ON CONFLICT (guild_id, author_id) DO UPDATE SET stars = r.stars + EXCLUDED.stars
+                   ), givers AS (
+                       INSERT INTO starboard_givers AS g (guild_id, author_id, stars)
+                       SELECT $1, author_id, SUM(delta)
+                       FROM changes
+                       GROUP BY author_id
+                       ON CONFLICT (guild_id, author_id) DO UPDATE SET stars = g.stars + EXCLUDED.stars
+                   )
+                   SELECT message_id, bot_message_id, star_count FROM updated
+                   UNION ALL
+                   SELECT message_id, NULL, star_count FROM created
+                   UNION ALL
+                   SELECT message_id, bot_message_id, 0 FROM dropped;
+                """
+
+        # lock in a consistent order so overlapping batches can't deadlock, and
+        # before acquiring a connection, the same as star_message does
+        locks = [self.get_message_lock(message_id) for message_id in sorted(channels)]
+        acquired = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+
+            async with self.bot.pool.acquire() as con:
+                records = await con.fetch(query, guild.id, rows)
+
+            # the connection isn't held while talking to discord
+            for message_id, bot_message_id, count in records:
+                try:
+                    await self.render_entry(starboard, channels[message_id], message_id, bot_message_id, count,
+                                            connection=self.bot.pool, message=messages.get(message_id))
+                except StarError:
+                    pass
+                except discord.HTTPException as e:
+                    log.warning('Could not update the starboard post for message ID %s: %s', message_id, e)
+        finally:
+            for lock in acquired:
+                lock.release()
+
+    async def reconcile_leaderboard(self, guild_id, *, connection=None):
+        """Recomputes a guild's leaderboards from its starboard entries."""
+        async with db.MaybeAcquire(connection, pool=self.bot.pool) as con:
+            async with con.transaction():
+                await con.execute("DELETE FROM starboard_receivers WHERE guild_id=$1;", guild_id)
+                await con.execute("DELETE FROM starboard_givers WHERE guild_id=$1;", guild_id)
+
+                query = """INSERT INTO starboard_receivers (guild_id, author_id, stars)
+                           SELECT guild_id, author_id, SUM(star_count)
+                           FROM starboard_entries
+                           WHERE guild_id=$1
+                           AND author_id IS NOT NULL
+                           GROUP BY guild_id, author_id;
+                        """
+                await con.execute(query, guild_id)
+
+                query = """INSERT INTO starboard_givers (guild_id, author_id, stars)
+                           SELECT entry.guild_id, starrers.author_id, COUNT(*)
+                           FROM starrers
+                           INNER JOIN starboard_entries entry
+                           ON entry.id = starrers.entry_id
+                           WHERE entry.guild_id=$1
+                           GROUP BY entry.guild_id, starrers.author_id;
+                        """
+                await con.execute(query, guild_id)
+
+    @tasks.loop(minutes=10.0)
+    async def reconcile_leaderboards(self):
+        dirty = list(self._dirty_leaderboards)
+        self._dirty_leaderboards.clear()
+        for guild_id in dirty:
+            try:
+                await self.reconcile_leaderboard(guild_id)
+            except (OSError, asyncpg.PostgresError):
+                log.exception('Could not reconcile the starboard leaderboards of guild ID %s', guild_id)
+                self._dirty_leaderboards.add(guild_id)
+
+    @reconcile_leaderboards.before_loop
+    async def before_reconcile_leaderboards(self):
+        # starboards that predate the leaderboards don't have any rows yet
+        query = """SELECT starboard.id
+                   FROM starboard
+                   WHERE NOT EXISTS (SELECT 1 FROM starboard_receivers r WHERE r.guild_id = starboard.id)
+                   AND EXISTS (SELECT 1 FROM starboard_entries e WHERE e.guild_id = starboard.id);
+                """
+        records = await self.bot.pool.fetch(query)
+        self._dirty_leaderboards.update(r[0] for r in records)
+
+    def add_post(self, guild_id, message_id):
+        sampler = self._post_samplers.get(guild_id)
+        if sampler is not None:
+            sampler.add(message_id)
+
+    def discard_post(self, guild_id, message_id):
+        sampler = self._post_samplers.get(guild_id)
+        if sampler is not None:
+            sampler.discard(message_id)
+
+    async def get_post_sampler(self, guild_id, *, connection):
+        try:
+            return self._post_samplers[guild_id]
+        except KeyError:
+            pass
+
+        query = "SELECT COUNT(*) FROM starboard_entries WHERE guild_id=$1 AND bot_message_id IS NOT NULL;"
+        count = await connection.fetchval(query, guild_id)
+        if count > self.sampler_limit:
+            sampler = PostCount(count)
+        else:
+            query = "SELECT bot_message_id FROM starboard_entries WHERE guild_id=$1 AND bot_message_id IS NOT NULL;"
+            records = await connection.fetch(query, guild_id)
+            sampler = PostSampler(r[0] for r in records)
+
+        self._post_samplers[guild_id] = sampler
+        return sampler
+
+    async def random_post(self, guild_id, *, connection):
+        """Picks the message ID of a random starboard post, if any."""
+        sampler = await self.get_post_sampler(guild_id, connection=connection)
+        if isinstance(sampler, PostSampler):
+            return sampler.choice()
+
+        # too many posts to keep around, so skip a random number
+        # of them along the guild_posted index instead
+        query = """SELECT bot_message_id
+                   FROM starboard_entries
+                   WHERE guild_id=$1
+                   AND bot_message_id IS NOT NULL
+                   ORDER BY bot_message_id
+                   OFFSET $2
+                   LIMIT 1;
+                """
+
+        if sampler.count:
+            message_id = await connection.fetchval(query, guild_id, random.randrange(sampler.count))
+            if message_id is not None:
+                return message_id
+
+        # posts got deleted without us knowing, so the count is off
+        self._post_samplers.pop(guild_id)
+        sampler = await self.get_post_sampler(guild_id, connection=connection)
+        if isinstance(sampler, PostSampler):
+            return sampler.choice()
+        return await connection.fetchval(query, guild_id, random.randrange(sampler.count))
+
+    async def resume_jobs(self):
+        await self.bot.wait_until_ready()
+        records = await self.bot.pool.fetch("SELECT * FROM starboard_jobs;")
+        for record in records:
+            # other clusters share the table, their jobs are theirs to resume
+            if self.bot.get_guild(record['guild_id']) is not None:
+                self.start_job(StarboardJob(record=record))
+
+    def start_job(self, job):
+        self._jobs[job.id] = self.bot.loop.create_task(self._run_job(job))
+
+    async def create_job(self, ctx, kind, **state):
+        """Starts a background job for the guild.
+
+        The job runs ``<kind>_job`` and reports its progress in
+        the invoking channel.
+
+        Raises
+        -------
+        StarError
+            A job of this kind is already running in the guild.
+        """
+
+        query = """INSERT INTO starboard_jobs (guild_id, kind, author_id, channel_id, state)
+                   VALUES ($1, $2, $3, $4, $5)
+                   ON CONFLICT (guild_id, kind) DO NOTHING
+                   RETURNING *;
+                """
+
+        record = await ctx.db.fetchrow(query, ctx.guild.id, kind, ctx.author.id, ctx.channel.id, state)
+        if record is None:
+            raise StarError(f'\N{NO ENTRY SIGN} A {kind} job is already running in this server.')
+
+        job = StarboardJob(record=record)
+        self.start_job(job)
+        return job
+
+    async def save_job(self, job, *, connection=None):
+        connection = connection or self.bot.pool
+        query = "UPDATE starboard_jobs SET state=$2, progress_id=$3 WHERE id=$1;"
+        await connection.execute(query, job.id, job.state, job.progress_id)
+
+    async def report_job(self, job, content, *, final=False):
+        """Edits the job's progress message, or posts a new one when finished."""
+
+        if not final:
+            now = time.monotonic()
+            if now - job.last_report < self.report_interval:
+                return
+            job.last_report = now
+
+        http = self.bot.http
+        if job.progress_id is not None and not final:
+            try:
+                await http.edit_message(job.channel_id, job.progress_id, content=content)
+            except discord.NotFound:
+                pass
+            except discord.HTTPException:
+                return
+            else:
+                return
+
+        try:
+            data = await http.send_message(job.channel_id, content)
+        except discord.HTTPException:
+            return
+
+        if not final:
+            job.progress_id = int(data['id'])
+
+    async def _run_job(self, job):
+        guild = self.bot.get_guild(job.guild_id)
+        handler = getattr(self, f'{job.kind}_job', None)
+        if guild is None or handler is None:
+            # not ours to finish, the row only goes away along with the starboard
+            self._jobs.pop(job.id, None)
+            return
+
+        try:
+            content = await handler(guild, job)
+        except asyncio.CancelledError:
+            # the row is kept around so this gets resumed later
+            raise
+        except Exception:
+            log.exception('Starboard job %r failed', job)
+            content = f'<@{job.author_id}>, the starboard {job.kind} job ran into an error and was stopped.'
+
+        self._jobs.pop(job.id, None)
+        await self.bot.pool.execute("DELETE FROM starboard_jobs WHERE id=$1;", job.id)
+        if content is not None:
+            await self.report_job(job, content, final=True)
+
+    async def delete_posts(self, channel, message_ids, *, bulk):
+        """Deletes starboard posts, bulk deleting where Discord allows it.
+
+        Posts older than 14 days can't be bulk deleted so they're
+        deleted one at a time, spaced out to stay clear of rate limits.
+
+        Returns
+        --------
+        Tuple[List[int], int]
+            The IDs of the posts that are gone and how many couldn't be deleted.
+        """
+
+        deleted = []
+        failed = 0
+        self._about_to_be_deleted.update(message_ids)
+
+        # we cannot bulk delete entries over 14 days old
+        min_snowflake = int((time.time() - 14 * 24 * 60 * 60) * 1000.0 - 1420070400000) << 22
+        if bulk:
+            recent = [message_id for message_id in message_ids if message_id > min_snowflake]
+            single = [message_id for message_id in message_ids if message_id <= min_snowflake]
+        else:
+            recent = []
+            single = list(message_ids)
+
+        for index in range(0, len(recent), 100):
+            chunk = recent[index:index + 100]
+            try:
+                await channel.delete_messages([discord.Object(id=message_id) for message_id in chunk])
+            except discord.HTTPException:
+                self._about_to_be_deleted.difference_update(chunk)
+                failed += len(chunk)
+            else:
+                deleted.extend(chunk)
+
+        for message_id in single:
+            try:
+                await self.bot.http.delete_message(channel.id, message_id)
+            except discord.NotFound:
+                # already gone, so no delete event is coming for it
+                self._about_to_be_deleted.discard(message_id)
+                deleted.append(message_id)
+            except discord.HTTPException:
+                self._about_to_be_deleted.discard(message_id)
+                failed += 1
+            else:
+                deleted.append(message_id)
+                await asyncio.sleep(self.single_delete_interval)
+
+        return deleted, failed
+
+    async def clean_job(self, guild, job):
+        starboard = await self.get_starboard(guild.id)
+        channel = starboard.channel
+        if channel is None:
+            return f'<@{job.author_id}>, the starboard channel is gone so it was not cleaned.'
+
+        state = job.state
+        bulk = channel.permissions_for(guild.me).manage_messages
+
+        query = """SELECT bot_message_id
+                   FROM starboard_entries
+                   WHERE guild_id=$1
+                   AND bot_message_id IS NOT NULL
+                   AND bot_message_id > $2
+                   AND star_count <= $3
+                   ORDER BY bot_message_id
+                   LIMIT $4;
+                """
+
+        while True:
+            records = await self.bot.pool.fetch(query, guild.id, state['cursor'], state['stars'], self.clean_batch_size)
+            if not records:
+                break
+
+            # the posts go before their entries, so a restart in between finds the
+            # same entries again and a post that couldn't be deleted keeps its entry
+            message_ids = [r[0] for r in records]
+            deleted, failed = await self.delete_posts(channel, message_ids, bulk=bulk)
+
+            async with self.bot.pool.acquire() as con:
+                async with con.transaction():
+                    delete = "DELETE FROM starboard_entries WHERE bot_message_id=ANY($1::bigint[]);"
+                    await con.execute(delete, deleted)
+                    state['cursor'] = message_ids[-1]
+                    state['deleted'] += len(deleted)
+                    state['failed'] += failed
+                    await self.save_job(job, connection=con)
+
+            self._dirty_leaderboards.add(guild.id)
+            for message_id in deleted:
+                self._message_cache.pop(message_id)
+                self.cancel_edit(message_id)
+                self.discard_post(guild.id, message_id)
+
+            await self.report_job(job, f'Cleaning the starboard... {plural(state["deleted"]):message} deleted so far.')
+
+        content = f'<@{job.author_id}>, finished cleaning the starboard. ' \
+                  f'\N{PUT LITTER IN ITS PLACE SYMBOL} Deleted {plural(state["deleted"]):message}.'
+        if state['failed']:
+            content = f'{content} Could not delete {plural(state["failed"]):message}.'
+        return content
+
+    async def migrate_post(self, message, guild_id, semaphore):
+        """Adds the jump link to a starboard post from before it was a thing.
+
+        Returns
+        --------
+        Optional[bool]
+            Whether the post got updated, or None if it didn't need to be.
+        """
+
+        match = self.valid_post.match(message.content)
+        if match is None or len(message.embeds) == 0:
+            return None
+
+        embed = message.embeds[0]
+        if len(embed.fields) != 0 and embed.fields[0].name != 'Attachments':
+            return None
+
+        async with semaphore:
+            if message.id in self._edits:
+                # a fresh render is about to replace it anyway
+                return None
+
+            url = f'https://discordapp.com/channels/{guild_id}/{match.group("channel_id")}/{match.group("message_id")}'
+            embed.add_field(name='Original', value=f'[Jump!]({url})', inline=False)
+            try:
+                await message.edit(embed=embed)
+            except discord.HTTPException:
+                return False
+
+            self._message_cache.pop(message.id)
+            return True
+
+    async def migrate_job(self, guild, job):
+        starboard = await self.get_starboard(guild.id)
+        channel = starboard.channel
+        if channel is None:
+            return f'<@{job.author_id}>, the starboard channel is gone so it was not migrated.'
+
+        state = job.state
+        semaphore = asyncio.Semaphore(self.migrate_concurrency)
+        while True:
+            before = state['cursor'] and discord.Object(id=state['cursor'])
+            messages = await channel.history(limit=100, before=before).flatten()
+            if not messages:
+                break
+
+            results = await asyncio.gather(*[self.migrate_post(m, guild.id, semaphore) for m in messages])
+            state['fetched'] += len(messages)
+            state['updated'] += sum(1 for r in results if r is True)
+            state['failed'] += sum(1 for r in results if r is False)
+            state['cursor'] = messages[-1].id
+            await self.save_job(job)
+            await self.report_job(job, f'Migrating the starboard... {state["fetched"]} messages checked so far.')
+
+        if starboard.needs_migration:
+            query = "UPDATE starboard SET locked=FALSE WHERE id=$1 AND locked IS NULL;"
+            await self.bot.pool.execute(query, guild.id)
+            self.get_starboard.invalidate(self, guild.id)
+
+        delta = time.time() - state['started']
+        return f'<@{job.author_id}>, we are done migrating!\n' \
+               f'Updated {state["updated"]}/{state["fetched"]} entries to the new format ' \
+               f'({state["failed"]} failed).\n' \
+               f'Took {delta:.2f}s.'
+
+    def get_message_lock(self, message_id):
+        # these only live for as long as someone is holding or waiting on them
+        lock = self._locks.get(message_id)
+        if lock is None:
+            self._locks[message_id] = lock = asyncio.Lock(loop=self.bot.loop)
+        return lock
+
+    def get_guild_lock(self, guild_id):
+        lock = self._guild_locks.get(guild_id)
+        if lock is None:
+            self._guild_locks[guild_id] = lock = asyncio.Lock(loop=self.bot.loop)
+        return lock
+
+    def get_flush_lock(self, guild_id):
+        lock = self._flush_locks.get(guild_id)
+        if lock is None:
+            self._flush_locks[guild_id] = lock = asyncio.Lock(loop=self.bot.loop)
+        return lock
 
     @cache.cache()
     async def get_starboard(self, guild_id, *, connection=None):
@@ -136,31 +1080,14 @@ class Stars(commands.Cog):
         return StarboardConfig(guild_id=guild_id, bot=self.bot, record=record)
 
     def star_emoji(self, stars):
-        if 5 > stars >= 0:
-            return '\N{WHITE MEDIUM STAR}'
-        elif 10 > stars >= 5:
-            return '\N{GLOWING STAR}'
-        elif 25 > stars >= 10:
-            return '\N{DIZZY SYMBOL}'
-        else:
-            return '\N{SPARKLES}'
+        if stars < 0:
+            return STAR_EMOJI[-1]
+        return STAR_EMOJI[min(stars, len(STAR_EMOJI) - 1)]
 
     def star_gradient_colour(self, stars):
-        # We define as 13 stars to be 100% of the star gradient (half of the 26 emoji threshold)
-        # So X / 13 will clamp to our percentage,
-        # We start out with 0xfffdf7 for the beginning colour
-        # Gradually evolving into 0xffc20c
-        # rgb values are (255, 253, 247) -> (255, 194, 12)
-        # To create the gradient, we use a linear interpolation formula
-        # Which for reference is X = X_1 * p + X_2 * (1 - p)
-        p = stars / 13
-        if p > 1.0:
-            p = 1.0
-
-        red = 255
-        green = int((194 * p) + (253 * (1 - p)))
-        blue = int((12 * p) + (247 * (1 - p)))
-        return (red << 16) + (green << 8) + blue
+        if stars < 0:
+            return _star_gradient_colour(stars)
+        return STAR_COLOURS[min(stars, len(STAR_COLOURS) - 1)]
 
     def is_url_spoiler(self, text, url):
         spoilers = self.spoilers.findall(text)
@@ -170,13 +1097,24 @@ class Stars(commands.Cog):
         return False
 
     def get_emoji_message(self, message, stars):
+        if message.template is None:
+            message.template = self.render_template(message)
+
+        suffix, template = message.template
         emoji = self.star_emoji(stars)
 
         if stars > 1:
-            content = f'{emoji} **{stars}** {message.channel.mention} ID: {message.id}'
+            content = f'{emoji} **{stars}** {suffix}'
         else:
-            content = f'{emoji} {message.channel.mention} ID: {message.id}'
+            content = f'{emoji} {suffix}'
+
+        # the fields aren't touched after this, so a shallow copy is enough
+        embed = copy.copy(template)
+        embed.colour = self.star_gradient_colour(stars)
+        return content, embed
 
+    def render_template(self, message):
+        suffix = f'<#{message.channel_id}> ID: {message.id}'
 
         embed = discord.Embed(description=message.content)
         if message.embeds:
@@ -185,20 +1123,19 @@ class Stars(commands.Cog):
                 embed.set_image(url=data.url)
 
         if message.attachments:
-            file = message.attachments[0]
-            spoiler = file.is_spoiler()
-            if not spoiler and file.url.lower().endswith(('png', 'jpeg', 'jpg', 'gif', 'webp')):
-                embed.set_image(url=file.url)
+            filename, url = message.attachments[0]
+            spoiler = filename.startswith('SPOILER_')
+            if not spoiler and url.lower().endswith(('png', 'jpeg', 'jpg', 'gif', 'webp')):
+                embed.set_image(url=url)
             elif spoiler:
-                embed.add_field(name='Attachment', value=f'||[{file.filename}]({file.url})||', inline=False)
+                embed.add_field(name='Attachment', value=f'||[{filename}]({url})||', inline=False)
             else:
-                embed.add_field(name='Attachment', value=f'[{file.filename}]({file.url})', inline=False)
+                embed.add_field(name='Attachment', value=f'[{filename}]({url})', inline=False)
 
         embed.add_field(name='Original', value=f'[Jump!]({message.jump_url})', inline=False)
-        embed.set_author(name=message.author.display_name, icon_url=message.author.avatar_url_as(format='png'))
+        embed.set_author(name=message.author_name, icon_url=message.author_avatar)
         embed.timestamp = message.created_at
-        embed.colour = self.star_gradient_colour(stars)
-        return content, embed
+        return suffix, embed
 
     async def get_message(self, channel, message_id):
         try:
@@ -213,11 +1150,92 @@ class Stars(commands.Cog):
                 if msg.id != message_id:
                     return None
 
-                self._message_cache[message_id] = msg
-                return msg
+                snapshot = self._message_cache[message_id] = MessageSnapshot(msg)
+                return snapshot
             except Exception:
                 return None
 
+    def check_starrable(self, starboard, channel, msg):
+        if channel.is_nsfw() and not starboard.channel.is_nsfw():
+            raise StarError('\N{NO ENTRY SIGN} Cannot star NSFW in non-NSFW starboard channel.')
+
+        if msg is None:
+            raise StarError('\N{BLACK QUESTION MARK ORNAMENT} This message could not be found.')
+
+        if (len(msg.content) == 0 and len(msg.attachments) == 0) or msg.type is not discord.MessageType.default:
+            raise StarError('\N{NO ENTRY SIGN} This message cannot be starred.')
+
+        oldest_allowed = datetime.datetime.utcnow() - starboard.max_age
+        if msg.created_at < oldest_allowed:
+            raise StarError('\N{NO ENTRY SIGN} This message is too old.')
+
+    async def render_entry(self, starboard, channel, message_id, bot_message_id, count, *, connection, message=None):
+        """Posts, edits or deletes the starboard post of an entry to match its star count.
+
+        Parameters
+        ------------
+        starboard: :class:`StarboardConfig`
+            The guild's starboard.
+        channel: :class:`TextChannel`
+            The channel that the starred message belongs to.
+        message_id: int
+            The message ID of the starred message.
+        bot_message_id: Optional[int]
+            The message ID of the starboard post, if any.
+        count: int
+            The current star count.
+        connection: asyncpg.Connection
+            The connection to use.
+        message: Optional[:class:`MessageSnapshot`]
+            The starred message, if it was already fetched.
+        """
+
+        starboard_channel = starboard.channel
+        if count < starboard.threshold:
+            if bot_message_id is None:
+                return
+
+            bot_message = await self.get_message(starboard_channel, bot_message_id)
+            if bot_message is None:
+                return
+
+            self._about_to_be_deleted.add(bot_message_id)
+            if count:
+                # update the bot_message_id to be NULL in the table since we're deleting it
+                query = "UPDATE starboard_entries SET bot_message_id=NULL WHERE message_id=$1;"
+                await connection.execute(query, message_id)
+
+            self._message_cache.pop(bot_message_id)
+            self.cancel_edit(bot_message_id)
+            self.discard_post(starboard.id, bot_message_id)
+            await bot_message.delete()
+            return
+
+        msg = message or await self.get_message(channel, message_id)
+        if msg is None:
+            raise StarError('\N{BLACK QUESTION MARK ORNAMENT} This message could not be found.')
+
+        # at this point, we either edit the message or we create a message
+        # with our star info
+        content, embed = self.get_emoji_message(msg, count)
+
+        if bot_message_id is None:
+            new_msg = await starboard_channel.send(content, embed=embed)
+            self._message_cache[new_msg.id] = MessageSnapshot(new_msg)
+            query = "UPDATE starboard_entries SET bot_message_id=$1 WHERE message_id=$2;"
+            await connection.execute(query, new_msg.id, message_id)
+            self.add_post(starboard.id, new_msg.id)
+        else:
+            new_msg = await self.get_message(starboard_channel, bot_message_id)
+            if new_msg is None:
+                # deleted? might as well purge the data
+                query = "DELETE FROM starboard_entries WHERE message_id=$1;"
+                await connection.execute(query, message_id)
+                self._dirty_leaderboards.add(starboard.id)
+                self.discard_post(starboard.id, bot_message_id)
+            else:
+                self.schedule_edit(new_msg, content, embed)
+
     async def reaction_action(self, fmt, payload):
         if str(payload.emoji) != '\N{WHITE MEDIUM STAR}':
             return
@@ -226,16 +1244,11 @@ class Stars(commands.Cog):
         if not isinstance(channel, discord.TextChannel):
             return
 
-        method = getattr(self, f'{fmt}_message')
-
         user = self.bot.get_user(payload.user_id)
         if user is None or user.bot:
             return
 
-        try:
-            await method(channel, payload.message_id, payload.user_id, verify=True)
-        except StarError:
-            pass
+        self.queue_reaction(channel, payload.message_id, payload.user_id, fmt == 'star')
 
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel):
@@ -250,6 +1263,7 @@ class Stars(commands.Cog):
         async with self.bot.pool.acquire() as con:
             query = "DELETE FROM starboard WHERE id=$1;"
             await con.execute(query, channel.guild.id)
+            self._post_samplers.pop(channel.guild.id)
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
@@ -259,8 +1273,20 @@ class Stars(commands.Cog):
     async def on_raw_reaction_remove(self, payload):
         await self.reaction_action('unstar', payload)
 
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload):
+        author = payload.data.get('author')
+        if author is not None and int(author['id']) == self.bot.user.id:
+            # our own starboard edits are written through already
+            return
+
+        # the next star will fetch the new content
+        self._message_cache.pop(payload.message_id)
+
     @commands.Cog.listener()
     async def on_raw_message_delete(self, payload):
+        self._message_cache.pop(payload.message_id)
+        self.cancel_edit(payload.message_id)
         if payload.message_id in self._about_to_be_deleted:
             # we triggered this deletion ourselves and
             # we don't need to drop it from the database
@@ -276,9 +1302,15 @@ class Stars(commands.Cog):
         async with self.bot.pool.acquire() as con:
             query = "DELETE FROM starboard_entries WHERE bot_message_id=$1;"
             await con.execute(query, payload.message_id)
+            self._dirty_leaderboards.add(payload.guild_id)
+            self.discard_post(payload.guild_id, payload.message_id)
 
     @commands.Cog.listener()
     async def on_raw_bulk_message_delete(self, payload):
+        for message_id in payload.message_ids:
+            self._message_cache.pop(message_id)
+            self.cancel_edit(message_id)
+
         if payload.message_ids <= self._about_to_be_deleted:
             # see comment above
             self._about_to_be_deleted.difference_update(payload.message_ids)
@@ -291,6 +1323,9 @@ class Stars(commands.Cog):
         async with self.bot.pool.acquire() as con:
             query = "DELETE FROM starboard_entries WHERE bot_message_id=ANY($1::bigint[]);"
             await con.execute(query, list(payload.message_ids))
+            self._dirty_leaderboards.add(payload.guild_id)
+            for message_id in payload.message_ids:
+                self.discard_post(payload.guild_id, message_id)
 
     @commands.Cog.listener()
     async def on_raw_reaction_clear(self, payload):
@@ -309,31 +1344,90 @@ class Stars(commands.Cog):
             if bot_message_id is None:
                 return
 
-
+            self._dirty_leaderboards.add(channel.guild.id)
             bot_message_id = bot_message_id[0]
+            self.discard_post(channel.guild.id, bot_message_id)
             msg = await self.get_message(starboard.channel, bot_message_id)
             if msg is not None:
+                self._message_cache.pop(bot_message_id)
+                self.cancel_edit(bot_message_id)
                 await msg.delete()
 
+    async def resolve_entry(self, guild_id, message_id, *, connection=None):
+        """Maps a starred message or its starboard post to the starred message.
+
+        The mapping never changes once it exists, so it's cached.
+
+        Returns
+        --------
+        Optional[Tuple[int, int]]
+            The channel ID and message ID of the starred message, or
+            None if neither ID is in the starboard.
+        """
+
+        try:
+            return self._entry_ids[guild_id, message_id]
+        except KeyError:
+            pass
+
+        # an OR over both columns can't use either index, this is two index probes
+        query = """SELECT channel_id, message_id FROM starboard_entries WHERE message_id=$2 AND guild_id=$1
+                   UNION ALL
+                   SELECT channel_id, message_id FROM starboard_entries WHERE bot_message_id=$2 AND guild_id=$1
+                   LIMIT 1;
+                """
+
+        connection = connection or self.bot.pool
+        record = await connection.fetchrow(query, guild_id, message_id)
+        if record is None:
+            return None
+
+        resolved = self._entry_ids[guild_id, message_id] = (record[0], record[1])
+        return resolved
+
+    async def resolve_starboard_message(self, channel, message_id, *, connection=None):
+        """Maps a post in the starboard channel to the message it's for.
+
+        Messages outside of the starboard channel are returned as-is.
+
+        Returns
+        --------
+        Tuple[:class:`TextChannel`, int]
+            The channel and ID of the original message.
+        """
+        starboard = await self.get_starboard(channel.guild.id)
+        starboard_channel = starboard.channel
+        if starboard_channel is None or channel.id != starboard_channel.id:
+            return channel, message_id
+
+        resolved = await self.resolve_entry(channel.guild.id, message_id, connection=connection)
+        if resolved is None:
+            raise StarError('Could not find message in the starboard.')
+
+        channel_id, original_id = resolved
+        ch = channel.guild.get_channel(channel_id)
+        if ch is None:
+            raise StarError('Could not find original channel.')
+
+        return ch, original_id
+
     async def star_message(self, channel, message_id, starrer_id, *, verify=False):
         guild_id = channel.guild.id
-        lock = self._locks.get(guild_id)
-        if lock is None:
-            self._locks[guild_id] = lock = asyncio.Lock(loop=self.bot.loop)
 
-        async with lock:
+        # starring the starboard post stars the original message,
+        # so that's the one that needs locking
+        original, original_id = await self.resolve_starboard_message(channel, message_id)
+
+        async with self.get_message_lock(original_id):
             async with self.bot.pool.acquire() as con:
                 if verify:
                     config = self.bot.get_cog('Config')
                     if config:
-                        plonked = await config.is_plonked(guild_id, starrer_id, channel_id=channel.id, connection=con)
-                        if plonked:
-                            return
-                        perms = await config.get_command_permissions(guild_id, connection=con)
-                        if perms.is_command_blocked('star', channel.id):
+                        eligibility = await config.get_star_eligibility(guild_id, connection=con)
+                        if not eligibility.can_star(channel.guild, starrer_id, channel.id):
                             return
 
-                await self._star_message(channel, message_id, starrer_id, connection=con)
+                await self._star_message(original, original_id, starrer_id, connection=con)
 
     async def _star_message(self, channel, message_id, starrer_id, *, connection):
         """Stars a message.
@@ -359,116 +1453,82 @@ class Stars(commands.Cog):
         if starboard.locked:
             raise StarError('\N{NO ENTRY SIGN} Starboard is locked.')
 
-        if channel.is_nsfw() and not starboard_channel.is_nsfw():
-            raise StarError('\N{NO ENTRY SIGN} Cannot star NSFW in non-NSFW starboard channel.')
-
         if channel.id == starboard_channel.id:
             # special case redirection code goes here
             # ergo, when we add a reaction from starboard we want it to star
             # the original message
-
-            query = "SELECT channel_id, message_id FROM starboard_entries WHERE bot_message_id=$1;"
-            record = await connection.fetchrow(query, message_id)
-            if record is None:
-                raise StarError('Could not find message in the starboard.')
-
-            ch = channel.guild.get_channel(record['channel_id'])
-            if ch is None:
-                raise StarError('Could not find original channel.')
-
-            return await self._star_message(ch, record['message_id'], starrer_id, connection=connection)
+            ch, original_id = await self.resolve_starboard_message(channel, message_id, connection=connection)
+            return await self._star_message(ch, original_id, starrer_id, connection=connection)
 
         if not starboard_channel.permissions_for(starboard_channel.guild.me).send_messages:
             raise StarError('\N{NO ENTRY SIGN} Cannot post messages in starboard channel.')
 
         msg = await self.get_message(channel, message_id)
+        self.check_starrable(starboard, channel, msg)
 
-        if msg is None:
-            raise StarError('\N{BLACK QUESTION MARK ORNAMENT} This message could not be found.')
-
-        if (len(msg.content) == 0 and len(msg.attachments) == 0) or msg.type is not discord.MessageType.default:
-            raise StarError('\N{NO ENTRY SIGN} This message cannot be starred.')
-
-        oldest_allowed = datetime.datetime.utcnow() - starboard.max_age
-        if msg.created_at < oldest_allowed:
-            raise StarError('\N{NO ENTRY SIGN} This message is too old.')
-
-        # check if this is freshly starred
-        # originally this was a single query but it seems
-        # WHERE ... = (SELECT ... in some_cte) is bugged
-        # so I'm going to do two queries instead
+        # record the starrer, bump the star count (unless the entry is brand new)
+        # and get the post to edit, all in one statement
         query = """WITH to_insert AS (
-                       INSERT INTO starboard_entries AS entries (message_id, channel_id, guild_id, author_id)
-                       VALUES ($1, $2, $3, $4)
+                       INSERT INTO starboard_entries AS entries (message_id, channel_id, guild_id, author_id, star_count)
+                       VALUES ($1, $2, $3, $4, 1)
                        ON CONFLICT (message_id) DO NOTHING
                        RETURNING entries.id
-                   )
-                   INSERT INTO starrers (author_id, entry_id)
-                   SELECT $5, entry.id
-                   FROM (
-                       SELECT id FROM to_insert
+                   ), entry AS (
+                       SELECT id, NULL::bigint AS bot_message_id FROM to_insert
                        UNION ALL
-                       SELECT id FROM starboard_entries WHERE message_id=$1
+                       SELECT id, bot_message_id FROM starboard_entries WHERE message_id=$1
                        LIMIT 1
-                   ) AS entry
-                   RETURNING entry_id;
+                   ), starrer AS (
+                       INSERT INTO starrers (author_id, entry_id)
+                       SELECT $5, entry.id FROM entry
+                       RETURNING entry_id
+                   ), receiver AS (
+                       INSERT INTO starboard_receivers AS r (guild_id, author_id, stars)
+                       SELECT $3, $4, 1 FROM starrer
+                       ON CONFLICT (guild_id, author_id) DO UPDATE SET stars = r.stars + 1
+                   ), giver AS (
+                       INSERT INTO starboard_givers AS g (guild_id, author_id, stars)
+                       SELECT $3, $5, 1 FROM starrer
+                       ON CONFLICT (guild_id, author_id) DO UPDATE SET stars = g.stars + 1
+                   ), bump AS (
+                       UPDATE starboard_entries
+                       SET star_count = star_count + 1
+                       WHERE id=(SELECT entry_id FROM starrer)
+                       AND NOT EXISTS (SELECT 1 FROM to_insert)
+                       RETURNING star_count
+                   )
+                   SELECT COALESCE((SELECT star_count FROM bump), 1), entry.bot_message_id
+                   FROM starrer
+                   INNER JOIN entry ON entry.id = starrer.entry_id;
                 """
 
         try:
-            record = await connection.fetchrow(query, message_id, channel.id, guild_id, msg.author.id, starrer_id)
+            record = await connection.fetchrow(query, message_id, channel.id, guild_id, msg.author_id, starrer_id)
         except asyncpg.UniqueViolationError:
             raise StarError('\N{NO ENTRY SIGN} You already starred this message.')
 
-        entry_id = record[0]
-
-        query = "SELECT COUNT(*) FROM starrers WHERE entry_id=$1;"
-        record = await connection.fetchrow(query, entry_id)
-
-        count = record[0]
-        if count < starboard.threshold:
-            return
-
-        # at this point, we either edit the message or we create a message
-        # with our star info
-        content, embed = self.get_emoji_message(msg, count)
-
-        # get the message ID to edit:
-        query = "SELECT bot_message_id FROM starboard_entries WHERE message_id=$1;"
-        record = await connection.fetchrow(query, message_id)
-        bot_message_id = record[0]
+        if record is None:
+            # the entry got deleted from under us
+            raise StarError('\N{BLACK QUESTION MARK ORNAMENT} This message could not be found.')
 
-        if bot_message_id is None:
-            new_msg = await starboard_channel.send(content, embed=embed)
-            query = "UPDATE starboard_entries SET bot_message_id=$1 WHERE message_id=$2;"
-            await connection.execute(query, new_msg.id, message_id)
-        else:
-            new_msg = await self.get_message(starboard_channel, bot_message_id)
-            if new_msg is None:
-                # deleted? might as well purge the data
-                query = "DELETE FROM starboard_entries WHERE message_id=$1;"
-                await connection.execute(query, message_id)
-            else:
-                await new_msg.edit(content=content, embed=embed)
+        count, bot_message_id = record
+        await self.render_entry(starboard, channel, message_id, bot_message_id, count,
+                                connection=connection, message=msg)
 
     async def unstar_message(self, channel, message_id, starrer_id, *, verify=False):
         guild_id = channel.guild.id
-        lock = self._locks.get(guild_id)
-        if lock is None:
-            self._locks[guild_id] = lock = asyncio.Lock(loop=self.bot.loop)
+        original, original_id = await self.resolve_starboard_message(channel, message_id)
 
-        async with lock:
+        async with self.get_message_lock(original_id):
             async with self.bot.pool.acquire() as con:
                 if verify:
                     config = self.bot.get_cog('Config')
                     if config:
-                        plonked = await config.is_plonked(guild_id, starrer_id, channel_id=channel.id, connection=con)
-                        if plonked:
-                            return
-                        perms = await config.get_command_permissions(guild_id, connection=con)
-                        if perms.is_command_blocked('star', channel.id):
+                        eligibility = await config.get_star_eligibility(guild_id, connection=con)
+                        if not eligibility.can_star(channel.guild, starrer_id, channel.id):
                             return
 
-                await self._unstar_message(channel, message_id, starrer_id, connection=con)
+                await self._unstar_message(original, original_id, starrer_id, connection=con)
 
     async def _unstar_message(self, channel, message_id, starrer_id, *, connection):
         """Unstars a message.
@@ -495,65 +1555,55 @@ class Stars(commands.Cog):
             raise StarError('\N{NO ENTRY SIGN} Starboard is locked.')
 
         if channel.id == starboard_channel.id:
-            query = "SELECT channel_id, message_id FROM starboard_entries WHERE bot_message_id=$1;"
-            record = await connection.fetchrow(query, message_id)
-            if record is None:
-                raise StarError('Could not find message in the starboard.')
-
-            ch = channel.guild.get_channel(record['channel_id'])
-            if ch is None:
-                raise StarError('Could not find original channel.')
-
-            return await self._unstar_message(ch, record['message_id'], starrer_id, connection=connection)
+            ch, original_id = await self.resolve_starboard_message(channel, message_id, connection=connection)
+            return await self._unstar_message(ch, original_id, starrer_id, connection=connection)
 
         if not starboard_channel.permissions_for(starboard_channel.guild.me).send_messages:
             raise StarError('\N{NO ENTRY SIGN} Cannot edit messages in starboard channel.')
 
-        query = """DELETE FROM starrers USING starboard_entries entry
-                   WHERE entry.message_id=$1
-                   AND   entry.id=starrers.entry_id
-                   AND   starrers.author_id=$2
-                   RETURNING starrers.entry_id, entry.bot_message_id
+        # remove the star and either decrement the count or,
+        # if that was the last star, delete the entry altogether
+        query = """WITH removed AS (
+                       DELETE FROM starrers USING starboard_entries entry
+                       WHERE entry.message_id=$1
+                       AND   entry.id=starrers.entry_id
+                       AND   starrers.author_id=$2
+                       RETURNING starrers.entry_id, entry.bot_message_id, entry.author_id
+                   ), dropped AS (
+                       DELETE FROM starboard_entries
+                       WHERE id=(SELECT entry_id FROM removed)
+                       AND star_count <= 1
+                   ), updated AS (
+                       UPDATE starboard_entries
+                       SET star_count = star_count - 1
+                       WHERE id=(SELECT entry_id FROM removed)
+                       AND star_count > 1
+                       RETURNING star_count
+                   ), receiver AS (
+                       UPDATE starboard_receivers
+                       SET stars = stars - 1
+                       WHERE guild_id=$3
+                       AND author_id=(SELECT author_id FROM removed)
+                   ), giver AS (
+                       UPDATE starboard_givers
+                       SET stars = stars - 1
+                       WHERE guild_id=$3
+                       AND author_id=$2
+                       AND EXISTS (SELECT 1 FROM removed)
+                   )
+                   SELECT entry_id, bot_message_id, COALESCE((SELECT star_count FROM updated), 0)
+                   FROM removed;
                 """
 
-        record = await connection.fetchrow(query, message_id, starrer_id)
+        record = await connection.fetchrow(query, message_id, starrer_id, guild_id)
         if record is None:
             raise StarError('\N{NO ENTRY SIGN} You have not starred this message.')
 
-        entry_id = record[0]
-        bot_message_id = record[1]
-
-        query = "SELECT COUNT(*) FROM starrers WHERE entry_id=$1;"
-        count = await connection.fetchrow(query, entry_id)
-        count = count[0]
-
-        if count == 0:
-            # delete the entry if we have no more stars
-            query = "DELETE FROM starboard_entries WHERE id=$1;"
-            await connection.execute(query, entry_id)
-
+        entry_id, bot_message_id, count = record
         if bot_message_id is None:
             return
 
-        bot_message = await self.get_message(starboard_channel, bot_message_id)
-        if bot_message is None:
-            return
-
-        if count < starboard.threshold:
-            self._about_to_be_deleted.add(bot_message_id)
-            if count:
-                # update the bot_message_id to be NULL in the table since we're deleting it
-                query = "UPDATE starboard_entries SET bot_message_id=NULL WHERE id=$1;"
-                await connection.execute(query, entry_id)
-
-            await bot_message.delete()
-        else:
-            msg = await self.get_message(channel, message_id)
-            if msg is None:
-                raise StarError('\N{BLACK QUESTION MARK ORNAMENT} This message could not be found.')
-
-            content, embed = self.get_emoji_message(msg, count)
-            await bot_message.edit(content=content, embed=embed)
+        await self.render_entry(starboard, channel, message_id, bot_message_id, count, connection=connection)
 
     @commands.group(invoke_without_command=True)
     @checks.is_mod()
@@ -567,6 +1617,11 @@ class Stars(commands.Cog):
         You must have Manage Server permission to use this.
         """
 
+        # two of these at once would make two channels
+        async with self.get_guild_lock(ctx.guild.id):
+            await self._create_starboard(ctx, name)
+
+    async def _create_starboard(self, ctx, name):
         # bypass the cache just in case someone used the star
         # reaction earlier before having it set up, or they
         # decided to use the ?star command
@@ -584,6 +1639,7 @@ class Stars(commands.Cog):
             else:
                 if confirm:
                     await ctx.db.execute('DELETE FROM starboard WHERE id=$1;', ctx.guild.id)
+                    self._post_samplers.pop(ctx.guild.id)
                 else:
                     return await ctx.send('Aborting starboard creation. Join the bot support server for more questions.')
 
@@ -683,44 +1739,17 @@ class Stars(commands.Cog):
         This removes messages in the starboard that only have less
         than or equal to the number of specified stars. This defaults to 1.
 
-        Note that this only checks the last 100 messages in the starboard.
+        The whole starboard is cleaned in the background and progress
+        is reported in this channel. Messages older than two weeks have
+        to be deleted one at a time, so this might take a while.
 
         This command requires the Manage Server permission.
         """
 
         stars = max(stars, 1)
-        channel = ctx.starboard.channel
-
-        last_messages = await channel.history(limit=100).map(lambda m: m.id).flatten()
-
-        query = """WITH bad_entries AS (
-                       SELECT entry_id
-                       FROM starrers
-                       INNER JOIN starboard_entries
-                       ON starboard_entries.id = starrers.entry_id
-                       WHERE starboard_entries.guild_id=$1
-                       AND   starboard_entries.bot_message_id = ANY($2::bigint[])
-                       GROUP BY entry_id
-                       HAVING COUNT(*) <= $3
-                   )
-                   DELETE FROM starboard_entries USING bad_entries
-                   WHERE starboard_entries.id = bad_entries.entry_id
-                   RETURNING starboard_entries.bot_message_id
-                """
-
-        to_delete = await ctx.db.fetch(query, ctx.guild.id, last_messages, stars)
-
-        # we cannot bulk delete entries over 14 days old
-        min_snowflake = int((time.time() - 14 * 24 * 60 * 60) * 1000.0 - 1420070400000) << 22
-        to_delete = [discord.Object(id=r[0]) for r in to_delete if r[0] > min_snowflake]
-
-        try:
-            self._about_to_be_deleted.update(o.id for o in to_delete)
-            await channel.delete_messages(to_delete)
-        except discord.HTTPException:
-            await ctx.send('Could not delete messages.')
-        else:
-            await ctx.send(f'\N{PUT LITTER IN ITS PLACE SYMBOL} Deleted {plural(len(to_delete)):message}.')
+        await self.create_job(ctx, 'clean', stars=stars, cursor=0, deleted=0, failed=0)
+        await ctx.send(f'Cleaning the starboard of messages with {plural(stars):star} or less. '
+                       'I will let you know when it is done.')
 
     @star.command(name='show')
     @requires_starboard()
@@ -734,19 +1763,19 @@ class Stars(commands.Cog):
         You can only use this command once per 10 seconds.
         """
 
-        query = """SELECT entry.channel_id,
-                          entry.message_id,
-                          entry.bot_message_id,
-                          COUNT(*) OVER(PARTITION BY entry_id) AS "Stars"
-                   FROM starrers
-                   INNER JOIN starboard_entries entry
-                   ON entry.id = starrers.entry_id
-                   WHERE entry.guild_id=$1
-                   AND (entry.message_id=$2 OR entry.bot_message_id=$2)
-                   LIMIT 1
+        resolved = await self.resolve_entry(ctx.guild.id, message, connection=ctx.db)
+        if resolved is None:
+            return await ctx.send('This message has not been starred.')
+
+        query = """SELECT channel_id,
+                          message_id,
+                          bot_message_id,
+                          star_count AS "Stars"
+                   FROM starboard_entries
+                   WHERE message_id=$1;
                 """
 
-        record = await ctx.db.fetchrow(query, ctx.guild.id, message)
+        record = await ctx.db.fetchrow(query, resolved[1])
         if record is None:
             return await ctx.send('This message has not been starred.')
 
@@ -761,6 +1790,8 @@ class Stars(commands.Cog):
                 # somehow it got deleted, so just delete the entry
                 query = "DELETE FROM starboard_entries WHERE message_id=$1;"
                 await ctx.db.execute(query, record['message_id'])
+                self._dirty_leaderboards.add(ctx.guild.id)
+                self.discard_post(ctx.guild.id, bot_message_id)
                 return
 
         # slow path, try to fetch the content
@@ -784,14 +1815,18 @@ class Stars(commands.Cog):
         or the message ID in the starboard channel.
         """
 
+        resolved = await self.resolve_entry(ctx.guild.id, message, connection=ctx.db)
+        if resolved is None:
+            return await ctx.send('No one starred this message or this is an invalid message ID.')
+
         query = """SELECT starrers.author_id
                    FROM starrers
                    INNER JOIN starboard_entries entry
                    ON entry.id = starrers.entry_id
-                   WHERE entry.message_id = $1 OR entry.bot_message_id = $1
+                   WHERE entry.message_id = $1
                 """
 
-        records = await ctx.db.fetch(query, message)
+        records = await ctx.db.fetch(query, resolved[1])
         if records is None or len(records) == 0:
             return await ctx.send('No one starred this message or this is an invalid message ID.')
 
@@ -810,13 +1845,55 @@ class Stars(commands.Cog):
         except Exception as e:
             await ctx.send(e)
 
+    @star.command(name='recount')
+    @checks.is_mod()
+    @requires_starboard()
+    async def star_recount(self, ctx):
+        """Recounts the stars of every starred message in the server.
+
+        This also recomputes the leaderboards shown by the stats
+        command. Only useful if the counts somehow went out of sync.
+
+        You must have Manage Server permissions to use this.
+        """
+
+        query = """UPDATE starboard_entries entry
+                   SET star_count = counts.total
+                   FROM (
+                       SELECT entry.id, COUNT(starrers.id) AS total
+                       FROM starboard_entries entry
+                       LEFT OUTER JOIN starrers
+                       ON starrers.entry_id = entry.id
+                       WHERE entry.guild_id=$1
+                       GROUP BY entry.id
+                   ) AS counts
+                   WHERE entry.id = counts.id
+                   AND entry.star_count <> counts.total;
+                """
+
+        status = await ctx.db.execute(query, ctx.guild.id)
+        fixed = int(status.split()[-1])
+        await self.reconcile_leaderboard(ctx.guild.id, connection=ctx.db)
+        await ctx.send(f'Fixed the star count of {plural(fixed):entry|entries}. The leaderboards have been recomputed.')
+
+    @star.command(name='cache', hidden=True)
+    @commands.is_owner()
+    async def star_cache(self, ctx):
+        """Shows how well the message cache is doing."""
+        cached = self._message_cache
+        await ctx.send(f'{len(cached)}/{cached.maxsize} messages cached, ' \
+                       f'{cached.hits} hits, {cached.misses} misses ({cached.hit_rate:.2%} hit rate), ' \
+                       f'{cached.evictions} evictions.')
+
     @star.command(name='migrate')
     @requires_starboard()
     @checks.is_mod()
     async def star_migrate(self, ctx):
         """Migrates the starboard to the newest version.
 
-        While doing this, the starboard is locked.
+        This goes through the entire starboard in the background
+        and reports its progress in this channel. The starboard
+        can still be used while this is happening.
 
         Note: This is an **incredibly expensive operation**.
 
@@ -829,57 +1906,8 @@ class Stars(commands.Cog):
         if not perms.read_message_history:
             return await ctx.send(f'Bot does not have Read Message History in {ctx.starboard.channel.mention}.')
 
-        if ctx.starboard.locked:
-            return await ctx.send('Starboard must be unlocked to migrate. It will be locked during the migration.')
-
-
-        start = time.time()
-        guild_id = ctx.guild.id
-        query = "UPDATE starboard SET locked=TRUE WHERE id=$1;"
-        await ctx.db.execute(query, guild_id)
-        self.get_starboard.invalidate(self, guild_id)
-
-        await ctx.send('Starboard is now locked and migration will now begin.')
-
-        valid_msg = re.compile(r'.+?<#(?P<channel_id>[0-9]{17,21})>\s*ID\:\s*(?P<message_id>[0-9]{17,21})')
-        async with ctx.typing():
-            fetched = 0
-            updated = 0
-            failed = 0
-
-            # At the time of writing, the average server only had ~256 entries.
-            async for message in ctx.starboard.channel.history(limit=1000):
-                fetched += 1
-
-                match = valid_msg.match(message.content)
-                if match is None:
-                    continue
-
-                groups = match.groupdict()
-                groups['guild_id'] = guild_id
-                fmt = 'https://discordapp.com/channels/{guild_id}/{channel_id}/{message_id}'.format(**groups)
-                if len(message.embeds) == 0:
-                    continue
-
-                embed = message.embeds[0]
-                if len(embed.fields) == 0 or embed.fields[0].name == 'Attachments':
-                    embed.add_field(name='Original', value=f'[Jump!]({fmt})', inline=False)
-                    try:
-                        await message.edit(embed=embed)
-                    except discord.HTTPException:
-                        failed += 1
-                    else:
-                        updated += 1
-
-            delta = time.time() - start
-            query = "UPDATE starboard SET locked = FALSE WHERE id=$1;"
-            await ctx.db.execute(query, guild_id)
-            self.get_starboard.invalidate(self, guild_id)
-
-            m = await ctx.send(f'{ctx.author.mention}, we are done migrating!\n' \
-                                'The starboard has been unlocked.\n' \
-                               f'Updated {updated}/{fetched} entries to the new format.\n' \
-                               f'Took {delta:.2f}s.')
+        await self.create_job(ctx, 'migrate', cursor=None, started=time.time(), fetched=0, updated=0, failed=0)
+        await ctx.send('Migration will now begin. I will let you know when it is done.')
 
     def records_to_value(self, records, fmt=None, default='None!'):
         if not records:
@@ -887,7 +1915,8 @@ class Stars(commands.Cog):
 
         emoji = 0x1f947 # :first_place:
         fmt = fmt or (lambda o: o)
-        return '\n'.join(f'{chr(emoji + i)}: {fmt(r["ID"])} ({plural(r["Stars"]):star})'
+        # the ID is always the first column and the stars the last
+        return '\n'.join(f'{chr(emoji + i)}: {fmt(r[0])} ({plural(r[-1]):star})'
                          for i, r in enumerate(records))
 
     async def star_guild_stats(self, ctx):
@@ -895,79 +1924,70 @@ class Stars(commands.Cog):
         e.timestamp = ctx.starboard.channel.created_at
         e.set_footer(text='Adding stars since')
 
-        # messages starred
-        query = "SELECT COUNT(*) FROM starboard_entries WHERE guild_id=$1;"
+        batch = db.Batch()
 
-        record = await ctx.db.fetchrow(query, ctx.guild.id)
-        total_messages = record[0]
+        # messages starred
+        batch.fetchval('total_messages', "SELECT COUNT(*) FROM starboard_entries WHERE guild_id=$1", ctx.guild.id)
 
         # total stars given
-        query = """SELECT COUNT(*)
-                   FROM starrers
-                   INNER JOIN starboard_entries entry
-                   ON entry.id = starrers.entry_id
-                   WHERE entry.guild_id=$1;
-                """
-
-        record = await ctx.db.fetchrow(query, ctx.guild.id)
-        total_stars = record[0]
-
-        e.description = f'{plural(total_messages):message} starred with a total of {total_stars} stars.'
-        e.colour = discord.Colour.gold()
+        batch.fetchval('total_stars', """SELECT COALESCE(SUM(stars), 0)
+                                         FROM starboard_receivers
+                                         WHERE guild_id=$1
+                                      """, ctx.guild.id)
 
         # this big query fetches 3 things:
         # top 3 starred posts (Type 3)
         # top 3 most starred authors  (Type 1)
         # top 3 star givers (Type 2)
 
-        query = """WITH t AS (
-                       SELECT
-                           entry.author_id AS entry_author_id,
-                           starrers.author_id,
-                           entry.bot_message_id
-                       FROM starrers
-                       INNER JOIN starboard_entries entry
-                       ON entry.id = starrers.entry_id
-                       WHERE entry.guild_id=$1
-                   )
-                   (
-                       SELECT t.entry_author_id AS "ID", 1 AS "Type", COUNT(*) AS "Stars"
-                       FROM t
-                       WHERE t.entry_author_id IS NOT NULL
-                       GROUP BY t.entry_author_id
-                       ORDER BY "Stars" DESC
+        query = """(
+                       SELECT author_id AS "ID", 1 AS "Type", stars AS "Stars"
+                       FROM starboard_receivers
+                       WHERE guild_id=$1
+                       AND stars > 0
+                       ORDER BY stars DESC
                        LIMIT 3
                    )
                    UNION ALL
                    (
-                       SELECT t.author_id AS "ID", 2 AS "Type", COUNT(*) AS "Stars"
-                       FROM t
-                       GROUP BY t.author_id
-                       ORDER BY "Stars" DESC
+                       SELECT author_id AS "ID", 2 AS "Type", stars AS "Stars"
+                       FROM starboard_givers
+                       WHERE guild_id=$1
+                       AND stars > 0
+                       ORDER BY stars DESC
                        LIMIT 3
                    )
                    UNION ALL
                    (
-                       SELECT t.bot_message_id AS "ID", 3 AS "Type", COUNT(*) AS "Stars"
-                       FROM t
-                       WHERE t.bot_message_id IS NOT NULL
-                       GROUP BY t.bot_message_id
-                       ORDER BY "Stars" DESC
+                       SELECT bot_message_id AS "ID", 3 AS "Type", star_count AS "Stars"
+                       FROM starboard_entries
+                       WHERE guild_id=$1
+                       AND bot_message_id IS NOT NULL
+                       ORDER BY star_count DESC
                        LIMIT 3
-                   );
+                   )
                 """
 
-        records = await ctx.db.fetch(query, ctx.guild.id)
-        starred_posts = [r for r in records if r['Type'] == 3]
+        batch.fetch('top', query, ctx.guild.id)
+        results = await batch.run(ctx.read_db)
+
+        total_messages = results['total_messages']
+        total_stars = results['total_stars']
+        e.description = f'{plural(total_messages):message} starred with a total of {total_stars} stars.'
+        e.colour = discord.Colour.gold()
+
+        # these come back as (ID, Type, Stars) tuples
+        records = results['top']
+        starred_posts = [r for r in records if r[1] == 3]
         e.add_field(name='Top Starred Posts', value=self.records_to_value(starred_posts), inline=False)
 
         to_mention = lambda o: f'<@{o}>'
 
-        star_receivers = [r for r in records if r['Type'] == 1]
+        star_receivers = [r for r in records if r[1] == 1]
         value = self.records_to_value(star_receivers, to_mention, default='No one!')
         e.add_field(name='Top Star Receivers', value=value, inline=False)
 
-        star_givers = [r for r in records if r['Type'] == 2]
+        star_givers = [r for r in records if r[1] == 2]
         value = self.records_to_value(star_givers, to_mention, default='No one!')
         e.add_field(name='Top Star Givers', value=value, inline=False)
 
@@ -977,51 +1997,34 @@ class Stars(commands.Cog):
         e = discord.Embed(colour=discord.Colour.gold())
         e.set_author(name=member.display_name, icon_url=member.avatar_url_as(format='png'))
 
-        # this query calculates
-        # 1 - stars received,
-        # 2 - stars given
-        # The rest are the top 3 starred posts
-
-        query = """WITH t AS (
-                       SELECT entry.author_id AS entry_author_id,
-                              starrers.author_id,
-                              entry.message_id
-                       FROM starrers
-                       INNER JOIN starboard_entries entry
-                       ON entry.id=starrers.entry_id
-                       WHERE entry.guild_id=$1
-                   )
-                   (
-                       SELECT '0'::bigint AS "ID", COUNT(*) AS "Stars"
-                       FROM t
-                       WHERE t.entry_author_id=$2
-                   )
-                   UNION ALL
-                   (
-                       SELECT '0'::bigint AS "ID", COUNT(*) AS "Stars"
-                       FROM t
-                       WHERE t.author_id=$2
-                   )
-                   UNION ALL
-                   (
-                       SELECT t.message_id AS "ID", COUNT(*) AS "Stars"
-                       FROM t
-                       WHERE t.entry_author_id=$2
-                       GROUP BY t.message_id
-                       ORDER BY "Stars" DESC
-                       LIMIT 3
-                   )
-                """
-
-        records = await ctx.db.fetch(query, ctx.guild.id, member.id)
-        received = records[0]['Stars']
-        given = records[1]['Stars']
-        top_three = records[2:]
-
-        # this query calculates how many of our messages were starred
-        query = """SELECT COUNT(*) FROM starboard_entries WHERE guild_id=$1 AND author_id=$2;"""
-        record = await ctx.db.fetchrow(query, ctx.guild.id, member.id)
-        messages_starred = record[0]
+        batch = db.Batch()
+        batch.fetchval('messages_starred', """SELECT COUNT(*)
+                                              FROM starboard_entries
+                                              WHERE guild_id=$1 AND author_id=$2
+                                           """, ctx.guild.id, member.id)
+
+        batch.fetchval('received', """SELECT COALESCE(SUM(stars), 0)
+                                      FROM starboard_receivers
+                                      WHERE guild_id=$1 AND author_id=$2
+                                   """, ctx.guild.id, member.id)
+
+        batch.fetchval('given', """SELECT COALESCE(SUM(stars), 0)
+                                   FROM starboard_givers
+                                   WHERE guild_id=$1 AND author_id=$2
+                                """, ctx.guild.id, member.id)
+
+        batch.fetch('top_three', """SELECT message_id, star_count
+                                    FROM starboard_entries
+                                    WHERE guild_id=$1 AND author_id=$2
+                                    ORDER BY star_count DESC
+                                    LIMIT 3
+                                 """, ctx.guild.id, member.id)
+
+        results = await batch.run(ctx.read_db)
+        messages_starred = results['messages_starred']
+        received = results['received']
+        given = results['given']
+        top_three = results['top_three']
 
         e.add_field(name='Messages Starred', value=messages_starred)
         e.add_field(name='Stars Received', value=received)
@@ -1046,27 +2049,13 @@ class Stars(commands.Cog):
     async def star_random(self, ctx):
         """Shows a random starred message."""
 
-        query = """SELECT bot_message_id
-                   FROM starboard_entries
-                   WHERE guild_id=$1
-                   AND bot_message_id IS NOT NULL
-                   OFFSET FLOOR(RANDOM() * (
-                       SELECT COUNT(*)
-                       FROM starboard_entries
-                       WHERE guild_id=$1
-                       AND bot_message_id IS NOT NULL
-                   ))
-                   LIMIT 1
-                """
-
-        record = await ctx.db.fetchrow(query, ctx.guild.id)
-
-        if record is None:
+        message_id = await self.random_post(ctx.guild.id, connection=ctx.db)
+        if message_id is None:
             return await ctx.send('Could not find anything.')
 
-        message_id = record[0]
         message = await self.get_message(ctx.starboard.channel, message_id)
         if message is None:
+            self.discard_post(ctx.guild.id, message_id)
             return await ctx.send(f'Message {message_id} has been deleted somehow.')
 
         if message.embeds:
@@ -1215,21 +2204,9 @@ class Stars(commands.Cog):
 
         await ctx.send(f'Preparing to send to {len(to_send)} channels (out of {len(records)}).')
 
-        success = 0
-        start = time.time()
-        for index, channel in enumerate(to_send):
-            if index % 5 == 0:
-                await asyncio.sleep(1)
-
-            try:
-                await channel.send(message)
-            except:
-                pass
-            else:
-                success += 1
-
-        delta = time.time() - start
-        await ctx.send(f'Successfully sent to {success} channels (out of {len(to_send)}) in {delta:.2f}s.')
+        result = await broadcast.broadcast((channel, message) for channel in to_send)
+        await ctx.send(f'Successfully sent to {result.sent} channels (out of {len(to_send)}) in {result.elapsed:.2f}s.\n'
+                       f'Latency: {result.latency.summary()}, rate limited {plural(result.rate_limited):time}.')
 
 def setup(bot):
     bot.add_cog(Stars(bot))
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+
+from collections import OrderedDict
+
+import discord
+
+from .metrics import Histogram
+
+log = logging.getLogger(__name__)
+
+class BroadcastResult:
+    """What happened while broadcasting.
+
+    Attributes
+    ------------
+    sent: int
+        How many messages were sent.
+    failed: int
+        How many messages could not be sent.
+    rate_limited: int
+        How many sends hit a 429 and had to back off.
+    latency: :class:`Histogram`
+        How long each successful send took, in seconds.
+    elapsed: float
+        How long the whole broadcast took, in seconds.
+    """
+
+    __slots__ = ('sent', 'failed', 'rate_limited', 'latency', 'elapsed')
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.latency = Histogram()
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return f'<BroadcastResult sent={self.sent} failed={self.failed} rate_limited={self.rate_limited}>'
+
+    @property
+    def total(self):
+        return self.sent + self.failed
+
+async def broadcast(destinations, *, concurrency=5, retries=3, backoff=1.0):
+    r"""Sends messages to a lot of channels without tripping rate limits.
+
+    Message sends are rate limited per channel, so everything meant
+    for the same channel is sent in order by a single worker, while
+    up to ``concurrency`` channels are sent to at the same time.
+
+    discord.py already retries rate limited requests, but if a send
+    still ends up with a 429 then every worker pauses for the backoff,
+    which doubles each time it happens, before retrying.
+
+    Sends that fail are counted and logged, except for channels that
+    are gone or that can't be sent to anymore.
+
+    Parameters
+    ------------
+    destinations: Iterable[Tuple[:class:`abc.Messageable`, str]]
+        The channels and what to send to them.
+    concurrency: int
+        How many channels are sent to at once.
+    retries: int
+        How many times a rate limited send is retried.
+    backoff: float
+        The initial backoff in seconds.
+
+    Returns
+    --------
+    :class:`BroadcastResult`
+        How it went.
+    """
+
+    # channel_id: (channel, [content])
+    buckets = OrderedDict()
+    for channel, content in destinations:
+        try:
+            buckets[channel.id][1].append(content)
+        except KeyError:
+            buckets[channel.id] = (channel, [content])
+
+    result = BroadcastResult()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # cleared while everyone is backing off
+    clear = asyncio.Event()
+    clear.set()
+    delay = backoff
+
+    async def pause():
+        nonlocal delay
+        if not clear.is_set():
+            # someone else is already backing off
+            await clear.wait()
+            return
+
+        clear.clear()
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            delay *= 2
+            clear.set()
+
+    async def send(channel, content):
+        nonlocal delay
+        for attempt in range(retries + 1):
+            await clear.wait()
+            start = time.perf_counter()
+            try:
+                await channel.send(content)
+            except (discord.Forbidden, discord.NotFound):
+                # the channel is gone or we can't talk in it anymore, nothing to report
+                result.failed += 1
+                return
+            except discord.HTTPException as e:
+                if e.status == 429 and attempt != retries:
+                    result.rate_limited += 1
+                    await pause()
+                    continue
+
+                log.warning('Could not broadcast to channel ID %s: %s', channel.id, e)
+                result.failed += 1
+                return
+            except Exception:
+                log.exception('Could not broadcast to channel ID %s', channel.id)
+                result.failed += 1
+                return
+            else:
+                result.latency.add(time.perf_counter() - start)
+                result.sent += 1
+                delay = backoff
+                return
+
+    async def drain(channel, contents):
+        async with semaphore:
+            for content in contents:
+                await send(channel, content)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[drain(channel, contents) for channel, contents in buckets.values()])
+    result.elapsed = time.perf_counter() - start
+    return result
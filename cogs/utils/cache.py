@@ -3,6 +3,7 @@ import asyncio
 import enum
 import time
 
+from collections import OrderedDict
 from functools import wraps
 
 from lru import LRU
@@ -42,6 +43,82 @@ class ExpiringCache(dict):
     def __setitem__(self, key, value):
         super().__setitem__(key, (value, time.monotonic()))
 
+class LRUCache:
+    """A cache bounded by size where entries also expire after a while.
+
+    The least recently used entry is evicted when it gets full and
+    expired entries are dropped lazily when they're looked up, so
+    unlike :class:`ExpiringCache` nothing ever scans the whole thing.
+    """
+
+    def __init__(self, maxsize, *, seconds):
+        self.maxsize = maxsize
+        self.ttl = seconds
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        try:
+            _, expires = self._data[key]
+        except KeyError:
+            return False
+        return expires > time.monotonic()
+
+    def __getitem__(self, key):
+        try:
+            value, expires = self._data[key]
+        except KeyError:
+            self.misses += 1
+            raise
+
+        if expires <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            raise KeyError(key)
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, default=None):
+        try:
+            value, _ = self._data.pop(key)
+        except KeyError:
+            return default
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+    def get_stats(self):
+        return self.hits, self.misses
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
 class Strategy(enum.Enum):
     lru = 1
     raw = 2
@@ -1,8 +1,15 @@
 from discord.ext import commands
+import functools
+import asyncpg
 import asyncio
 import discord
+import inspect
+import logging
+import time
 import io
 
+log = logging.getLogger(__name__)
+
 class _ContextDBAcquire:
     __slots__ = ('ctx', 'timeout')
 
@@ -20,11 +27,144 @@ class _ContextDBAcquire:
     async def __aexit__(self, *args):
         await self.ctx.release()
 
+class _DeferredConnectionCall:
+    """Stands in for ``transaction()`` or ``cursor()`` when the connection
+    was released for being idle, and only acquires a new one once it's
+    actually used.
+    """
+
+    __slots__ = ('ctx', 'method', 'args', 'kwargs', 'value')
+
+    def __init__(self, ctx, method, *args, **kwargs):
+        self.ctx = ctx
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.value = None
+
+    async def _resolve(self):
+        if self.value is None:
+            con = await self.ctx._acquire(None)
+            self.value = getattr(con, self.method)(*self.args, **self.kwargs)
+        return self.value
+
+    def __getattr__(self, attr):
+        if self.value is not None:
+            return getattr(self.value, attr)
+
+        # Transaction.start(), Cursor.fetch() etc
+        async def resolved(*args, **kwargs):
+            value = await self._resolve()
+            return await getattr(value, attr)(*args, **kwargs)
+        return resolved
+
+    async def __aenter__(self):
+        value = await self._resolve()
+        return await value.__aenter__()
+
+    async def __aexit__(self, *args):
+        return await self.value.__aexit__(*args)
+
+    def __await__(self):
+        return self._await().__await__()
+
+    async def _await(self):
+        value = await self._resolve()
+        return await value
+
+    async def _iterate(self):
+        value = await self._resolve()
+        async for record in value:
+            yield record
+
+    def __aiter__(self):
+        return self._iterate()
+
+class _TrackedConnection:
+    """What ``ctx.db`` hands out while a connection is acquired.
+
+    It forwards everything to the acquired connection but keeps track
+    of whether a query is running, so that idle connections can be
+    spotted. If the connection was released for being idle then the
+    next query transparently acquires a new one.
+    """
+
+    __slots__ = ('ctx',)
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+
+    def __getattr__(self, attr):
+        con = self.ctx._db
+        if con is not None:
+            return getattr(con, attr)
+
+        # the connection was released for being idle, so whatever
+        # is used next has to acquire a new one first
+        value = getattr(asyncpg.connection.Connection, attr)
+        if inspect.iscoroutinefunction(value):
+            return functools.partial(self._run, attr)
+
+        if attr in ('transaction', 'cursor'):
+            return functools.partial(_DeferredConnectionCall, self.ctx, attr)
+
+        raise RuntimeError(f'Connection was released for being idle, call ctx.acquire() before using {attr}.')
+
+    def __repr__(self):
+        return f'<_TrackedConnection connection={self.ctx._db!r}>'
+
+    async def _run(self, method, *args, **kwargs):
+        ctx = self.ctx
+        if ctx._db is None:
+            await ctx._acquire(None)
+
+        ctx._running_queries += 1
+        try:
+            return await getattr(ctx._db, method)(*args, **kwargs)
+        finally:
+            ctx._running_queries -= 1
+            ctx._db_last_used = time.monotonic()
+
+    async def execute(self, *args, **kwargs):
+        return await self._run('execute', *args, **kwargs)
+
+    async def executemany(self, *args, **kwargs):
+        return await self._run('executemany', *args, **kwargs)
+
+    async def fetch(self, *args, **kwargs):
+        return await self._run('fetch', *args, **kwargs)
+
+    async def fetchrow(self, *args, **kwargs):
+        return await self._run('fetchrow', *args, **kwargs)
+
+    async def fetchval(self, *args, **kwargs):
+        return await self._run('fetchval', *args, **kwargs)
+
+    async def copy_records_to_table(self, *args, **kwargs):
+        return await self._run('copy_records_to_table', *args, **kwargs)
+
 class Context(commands.Context):
+    # How long an acquired connection can go without running a query
+    # before something is done about it, in seconds.
+    idle_timeout = 15.0
+
+    # What to do about idle connections:
+    # 'warn' logs the offending command (useful while debugging,
+    # but prompt(reacquire=False) waiting on the user will trip it)
+    # 'release' gives the connection back to the pool, the next
+    # query made through ctx.db will acquire a new one.
+    # None disables the tracking entirely.
+    idle_action = None
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.pool = self.bot.pool
         self._db = None
+        self._tracked_db = None
+        self._db_last_used = 0.0
+        self._running_queries = 0
+        self._idle_handle = None
+        self._idle_released = False
 
     async def entry_to_code(self, entries):
         width = max(len(a) for a, b in entries)
@@ -169,13 +309,64 @@ class Context(commands.Context):
 
     @property
     def db(self):
-        return self._db if self._db else self.pool
+        if self.idle_action is None:
+            # nothing to track, so don't pay for the wrapper
+            return self._db if self._db is not None else self.pool
+
+        if self._db is not None or self._idle_released:
+            if self._tracked_db is None:
+                self._tracked_db = _TrackedConnection(self)
+            return self._tracked_db
+        return self.pool
+
+    @property
+    def read_db(self):
+        """Where heavy read only queries should go.
+
+        This is the read replica if one is configured and it's caught
+        up, otherwise it's the same as :attr:`db`. Don't use it to read
+        something that was just written.
+        """
+        read_pool = getattr(self.pool, 'read_pool', None)
+        if read_pool is None or read_pool is self.pool:
+            return self.db
+        return read_pool
 
     async def _acquire(self, timeout):
         if self._db is None:
             self._db = await self.pool.acquire(timeout=timeout)
+            self._idle_released = False
+            self._db_last_used = time.monotonic()
+            self._schedule_idle_check(self.idle_timeout)
         return self._db
 
+    def _schedule_idle_check(self, delay):
+        if self.idle_action is None:
+            return
+
+        self._idle_handle = self.bot.loop.call_later(delay, self._check_idle)
+
+    def _check_idle(self):
+        self._idle_handle = None
+        if self._db is None:
+            return
+
+        idle = time.monotonic() - self._db_last_used
+        if idle < self.idle_timeout:
+            # it got used in the meantime
+            return self._schedule_idle_check(self.idle_timeout - idle)
+
+        if self._running_queries or self._db.is_in_transaction():
+            return self._schedule_idle_check(self.idle_timeout)
+
+        name = self.command.qualified_name if self.command else None
+        if self.idle_action == 'release':
+            log.info('Releasing connection held idle for %.1fs by command %s.', idle, name)
+            self.bot.loop.create_task(self._release_idle())
+        else:
+            log.warning('Command %s has held a connection for %.1fs without running a query. '
+                        'Consider releasing it around user input.', name, idle)
+
     def acquire(self, *, timeout=None):
         """Acquires a database connection from the pool. e.g. ::
 
@@ -203,10 +394,26 @@ class Context(commands.Context):
         # from source digging asyncpg source, releasing an already
         # released connection does nothing
 
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+
+        self._idle_released = False
         if self._db is not None:
             await self.bot.pool.release(self._db)
             self._db = None
 
+    async def _release_idle(self):
+        if self._db is None:
+            return
+
+        # it might have been used between the check and now
+        if self._running_queries or time.monotonic() - self._db_last_used < self.idle_timeout:
+            return self._schedule_idle_check(self.idle_timeout)
+
+        await self.release()
+        self._idle_released = True
+
     async def show_help(self, command=None):
         """Shows the help command for the specified command if given.
 
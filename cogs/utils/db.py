@@ -30,9 +30,14 @@ DEALINGS IN THE SOFTWARE.
 
 from collections import OrderedDict
 from pathlib import Path
+from .metrics import Histogram
 import json
+import math
 import os
 import pydoc
+import re
+import sys
+import time
 import uuid
 import datetime
 import inspect
@@ -295,9 +300,9 @@ class Array(SQLType):
 
 class Column:
     __slots__ = ( 'column_type', 'index', 'primary_key', 'nullable',
-                  'default', 'unique', 'name', 'index_name' )
+                  'default', 'unique', 'name', 'index_name', 'backfill' )
     def __init__(self, column_type, *, index=False, primary_key=False,
-                 nullable=True, unique=False, default=None, name=None):
+                 nullable=True, unique=False, default=None, name=None, backfill=None):
 
         if inspect.isclass(column_type):
             column_type = column_type()
@@ -314,6 +319,10 @@ class Column:
         self.name = name
         self.index_name = None # to be filled later
 
+        # an SQL expression to fill existing rows with when the column
+        # gets added by a migration
+        self.backfill = backfill
+
         if sum(map(bool, (unique, primary_key, default is not None))) > 1:
             raise SchemaError("'unique', 'primary_key', and 'default' are mutually exclusive.")
 
@@ -374,6 +383,63 @@ class PrimaryKeyColumn(Column):
     def __init__(self):
         super().__init__(Integer(auto_increment=True), primary_key=True)
 
+class Index:
+    r"""An index spanning one or more columns or expressions.
+
+    Declare these as class attributes of a :class:`Table` when a
+    single ``Column(index=True)`` isn't enough. e.g. ::
+
+        class Foo(Table):
+            guild_id = Column(Integer(big=True))
+            entity_id = Column(Integer(big=True))
+
+            guild_entity = Index('guild_id', 'entity_id')
+            active = Index('guild_id', where='entity_id IS NOT NULL')
+            lowered = Index("(lower(name))")
+
+    Expressions must be wrapped in parentheses, as PostgreSQL requires.
+
+    Parameters
+    -----------
+    \*columns: str
+        The column names or parenthesised expressions to index, in order.
+    name: Optional[str]
+        The index name. Defaults to ``<table>_<attribute>_idx``.
+    where: Optional[str]
+        The predicate to use for a partial index.
+    unique: bool
+        Whether this is a UNIQUE index.
+    """
+
+    __slots__ = ('columns', 'name', 'where', 'unique')
+
+    def __init__(self, *columns, name=None, where=None, unique=False):
+        if len(columns) == 0:
+            raise SchemaError('an index requires at least one column or expression')
+
+        self.columns = list(columns)
+        self.name = name
+        self.where = where
+        self.unique = unique
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(*data['columns'], name=data['name'], where=data.get('where'), unique=data.get('unique', False))
+
+    def _to_dict(self):
+        return { attr: getattr(self, attr) for attr in self.__slots__ }
+
+    def _create_index(self, table_name):
+        builder = ['CREATE']
+        if self.unique:
+            builder.append('UNIQUE')
+
+        builder.append('INDEX IF NOT EXISTS %s ON %s (%s)' % (self.name, table_name, ', '.join(self.columns)))
+        if self.where:
+            builder.append('WHERE %s' % self.where)
+
+        return ' '.join(builder) + ';'
+
 class SchemaDiff:
     __slots__ = ('table', 'upgrade', 'downgrade')
 
@@ -437,11 +503,22 @@ class SchemaDiff:
         if sub_statements:
             statements.append(base + ', '.join(sub_statements) + ';')
 
+        # fill in the newly added columns before they get indexed
+        backfill = path.get('backfill', [])
+        if backfill:
+            assignments = ', '.join('{0[name]} = {0[expression]}'.format(b) for b in backfill)
+            statements.append('UPDATE %s SET %s;' % (self.table.__tablename__, assignments))
+
         # handle the index creation bits
         for dropped in path.get('drop_index', []):
             statements.append('DROP INDEX IF EXISTS {0[index]};'.format(dropped))
 
         for added in path.get('add_index', []):
+            if 'columns' in added:
+                # a table level index, see the Index class
+                statements.append(Index.from_dict(added)._create_index(self.table.__tablename__))
+                continue
+
             fmt = 'CREATE INDEX IF NOT EXISTS {0[index]} ON {1.__tablename__} ({0[name]});'
             statements.append(fmt.format(added, self.table))
 
@@ -464,6 +541,346 @@ class MaybeAcquire:
         if self._cleanup:
             await self.pool.release(self._connection)
 
+class Batch:
+    r"""Runs several statements in a single round trip.
+
+    Each statement becomes a CTE named after it, so later statements
+    can use the results of earlier ones by referring to that name. e.g. ::
+
+        batch = Batch()
+        batch.fetchval('entry', 'INSERT INTO entries (x) VALUES ($1) RETURNING id', 10)
+        batch.fetchval('total', 'SELECT COUNT(*) FROM things WHERE entry_id=(SELECT id FROM entry)')
+        results = await batch.run(connection)
+        entry_id, total = results['entry'], results['total']
+
+    Every statement numbers its own placeholders from ``$1``,
+    they're renumbered when the query is put together.
+
+    Note
+    ------
+    Just like regular CTEs, every statement sees the same snapshot
+    of the database. A statement does not see the rows inserted, updated
+    or deleted by another one, so use RETURNING and refer to it by name.
+    Data modifying statements also cannot have a WITH clause of their own.
+    """
+
+    _placeholder = re.compile(r'\$([0-9]+)')
+
+    def __init__(self):
+        # (name, query, args, mode)
+        self._statements = []
+
+    def __len__(self):
+        return len(self._statements)
+
+    def _add(self, mode, name, query, args):
+        if not name.isidentifier():
+            raise ValueError('statement name must be a valid identifier')
+
+        self._statements.append((name, query.strip().rstrip(';'), args, mode))
+
+    def fetch(self, name, query, *args):
+        """Adds a statement whose result is every row, as a list of tuples."""
+        self._add('fetch', name, query, args)
+
+    def fetchrow(self, name, query, *args):
+        """Adds a statement whose result is the first row as a tuple, or ``None``."""
+        self._add('fetchrow', name, query, args)
+
+    def fetchval(self, name, query, *args):
+        """Adds a statement whose result is the first column of the first row, or ``None``."""
+        self._add('fetchval', name, query, args)
+
+    def execute(self, name, query, *args):
+        """Adds a statement whose result is ignored.
+
+        Data modifying statements always run, even if nothing refers to them.
+        """
+        self._add('execute', name, query, args)
+
+    def to_sql(self):
+        """Returns a (query, args) tuple of the composed statement."""
+        ctes = []
+        columns = []
+        args = []
+
+        for name, query, statement_args, mode in self._statements:
+            offset = len(args)
+            query = self._placeholder.sub(lambda m: '$%d' % (int(m.group(1)) + offset), query)
+            args.extend(statement_args)
+            ctes.append('%s AS (\n%s\n)' % (name, query))
+
+            if mode == 'fetch':
+                columns.append('ARRAY(SELECT %s FROM %s) AS %s' % (name, name, name))
+            elif mode == 'fetchrow':
+                columns.append('(SELECT %s FROM %s LIMIT 1) AS %s' % (name, name, name))
+            elif mode == 'fetchval':
+                columns.append('(SELECT _%s.value FROM %s AS _%s(value) LIMIT 1) AS %s' % (name, name, name, name))
+
+        query = 'WITH %s\nSELECT %s;' % (',\n'.join(ctes), ', '.join(columns) or 'NULL')
+        return query, args
+
+    async def run(self, connection):
+        """Runs every statement and returns a dict of statement name to its result.
+
+        Statements added through :meth:`execute` map to ``None``.
+        """
+        query, args = self.to_sql()
+        record = await connection.fetchrow(query, *args)
+        results = {}
+        for name, _, _, mode in self._statements:
+            results[name] = None if mode == 'execute' else record[name]
+        return results
+
+# frames from the helpers in here (MaybeAcquire, Context.acquire, ...) are skipped
+# when figuring out who acquired a connection, so the site is the actual command
+_ACQUIRE_INTERNALS = os.path.dirname(__file__)
+
+def _acquire_call_site():
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        directory = os.path.dirname(filename)
+        package = os.path.basename(directory)
+        if directory != _ACQUIRE_INTERNALS and package not in ('asyncio', 'asyncpg'):
+            module = frame.f_globals.get('__name__', '?')
+            return '%s:%s:%s' % (module, frame.f_code.co_name, frame.f_lineno)
+        frame = frame.f_back
+    return '<unknown>'
+
+class _PoolAcquireContext:
+    __slots__ = ('pool', 'timeout', 'connection')
+
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.connection = None
+
+    def __await__(self):
+        return self.pool._acquire(self.timeout).__await__()
+
+    async def __aenter__(self):
+        self.connection = await self.pool._acquire(self.timeout)
+        return self.connection
+
+    async def __aexit__(self, *args):
+        con, self.connection = self.connection, None
+        await self.pool.release(con)
+
+class InstrumentedPool:
+    """Wraps an asyncpg pool and records how it's being used.
+
+    This keeps track of how long acquisitions had to wait, how long
+    each call site holds on to its connection and how often the pool
+    was fully checked out. Connections held for longer than
+    ``leak_threshold`` seconds are considered leaked and logged.
+
+    If a read replica pool is attached then :attr:`read_pool` routes
+    to it for as long as its replication lag stays under ``max_replica_lag``
+    seconds.
+
+    Anything not overridden here is forwarded to the underlying pool.
+    """
+
+    def __init__(self, pool, *, min_size=10, max_size=10, leak_threshold=120.0, replica=None, max_replica_lag=10.0):
+        self._pool = pool
+        self.min_size = min_size
+        self.max_size = max_size
+        self.leak_threshold = leak_threshold
+
+        self.replica = replica
+        self.max_replica_lag = max_replica_lag
+        # None means unknown or unreachable
+        self.replica_lag = None
+
+        self.acquire_wait = Histogram()
+        # how many connections were in use whenever someone acquired one
+        self.concurrency = Histogram(buckets=range(1, max_size + 1))
+        # call site: Histogram
+        self.hold_times = {}
+        # connection: (call site, acquired at)
+        self._held = {}
+        self._reported_leaks = set()
+
+        self.acquisitions = 0
+        # queries run through the pool itself rather than an acquired connection
+        self.queries = 0
+        self.timeouts = 0
+        self.exhausted = 0
+        self.peak_in_use = 0
+        self._monitor = None
+
+    def __getattr__(self, attr):
+        return getattr(self._pool, attr)
+
+    def __repr__(self):
+        return f'<InstrumentedPool in_use={self.in_use} max_size={self.max_size}>'
+
+    @property
+    def in_use(self):
+        return len(self._held)
+
+    def acquire(self, *, timeout=None):
+        return _PoolAcquireContext(self, timeout)
+
+    async def _acquire(self, timeout):
+        site = _acquire_call_site()
+        in_use = len(self._held)
+        if in_use >= self.max_size:
+            self.exhausted += 1
+
+        start = time.perf_counter()
+        try:
+            con = await self._pool.acquire(timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+        now = time.perf_counter()
+        self.acquisitions += 1
+        self.acquire_wait.add(now - start)
+        self._held[con] = (site, now)
+
+        in_use = len(self._held)
+        self.concurrency.add(in_use)
+        if in_use > self.peak_in_use:
+            self.peak_in_use = in_use
+        return con
+
+    async def release(self, connection, *, timeout=None):
+        try:
+            site, acquired = self._held.pop(connection)
+        except KeyError:
+            pass
+        else:
+            self._reported_leaks.discard(connection)
+            try:
+                histogram = self.hold_times[site]
+            except KeyError:
+                histogram = self.hold_times[site] = Histogram()
+            histogram.add(time.perf_counter() - acquired)
+
+        await self._pool.release(connection, timeout=timeout)
+
+    async def execute(self, query, *args, timeout=None):
+        self.queries += 1
+        async with self.acquire() as con:
+            return await con.execute(query, *args, timeout=timeout)
+
+    async def executemany(self, command, args, *, timeout=None):
+        self.queries += 1
+        async with self.acquire() as con:
+            return await con.executemany(command, args, timeout=timeout)
+
+    async def fetch(self, query, *args, timeout=None):
+        self.queries += 1
+        async with self.acquire() as con:
+            return await con.fetch(query, *args, timeout=timeout)
+
+    async def fetchval(self, query, *args, column=0, timeout=None):
+        self.queries += 1
+        async with self.acquire() as con:
+            return await con.fetchval(query, *args, column=column, timeout=timeout)
+
+    async def fetchrow(self, query, *args, timeout=None):
+        self.queries += 1
+        async with self.acquire() as con:
+            return await con.fetchrow(query, *args, timeout=timeout)
+
+    def leaked(self):
+        """Returns a list of (call site, seconds held) for connections held past the leak threshold."""
+        now = time.perf_counter()
+        return [(site, now - acquired)
+                for site, acquired in self._held.values()
+                if now - acquired > self.leak_threshold]
+
+    def check_leaks(self):
+        now = time.perf_counter()
+        for con, (site, acquired) in list(self._held.items()):
+            held = now - acquired
+            if held > self.leak_threshold and con not in self._reported_leaks:
+                self._reported_leaks.add(con)
+                log.warning('Connection acquired at %s has been held for %.0fs, possibly leaked.', site, held)
+
+    def suggested_size(self):
+        """Returns a (min_size, max_size) tuple based on the observed load.
+
+        asyncpg pools can't be resized while running, so this is only
+        a recommendation to apply the next time the pool is created.
+        """
+        if self.acquisitions == 0:
+            return self.min_size, self.max_size
+
+        # keep enough connections around for the typical load...
+        min_size = max(1, int(self.concurrency.percentile(0.5)))
+
+        # ...and grow the cap if people were queueing up for connections
+        max_size = max(self.peak_in_use + 2, min_size)
+        exhausted_ratio = self.exhausted / self.acquisitions
+        if exhausted_ratio > 0.01 or self.acquire_wait.percentile(0.99) > 0.1:
+            max_size = max(max_size, math.ceil(self.max_size * 1.5))
+        return min_size, max_size
+
+    @property
+    def read_pool(self):
+        """The pool to use for heavy read only queries.
+
+        This is the replica if there is one and it isn't lagging too
+        far behind, otherwise it's this pool.
+        """
+        replica = self.replica
+        if replica is not None and self.replica_lag is not None and self.replica_lag <= self.max_replica_lag:
+            return replica
+        return self
+
+    async def check_replica_lag(self):
+        if self.replica is None:
+            return None
+
+        # an idle primary doesn't produce any WAL to replay, so
+        # compare the positions before looking at the replay time
+        query = """SELECT CASE
+                       WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                       ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                   END;
+                """
+
+        try:
+            lag = await self.replica.fetchval(query, timeout=5.0)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+            if self.replica_lag is not None:
+                log.warning('Read replica is unreachable, falling back to the primary: %s', e)
+            self.replica_lag = None
+        else:
+            self.replica_lag = float(lag) if lag is not None else None
+
+        return self.replica_lag
+
+    def reset_stats(self):
+        self.acquire_wait.clear()
+        self.concurrency.clear()
+        self.hold_times.clear()
+        self.acquisitions = self.queries = self.timeouts = self.exhausted = 0
+        self.peak_in_use = len(self._held)
+
+    async def _monitor_loop(self, interval=10.0):
+        while True:
+            await self.check_replica_lag()
+            await asyncio.sleep(interval)
+            self.check_leaks()
+
+    def start_monitor(self):
+        if self._monitor is None:
+            self._monitor = asyncio.ensure_future(self._monitor_loop())
+
+    async def close(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        if self.replica is not None:
+            await self.replica.close()
+        await self._pool.close()
+
 class TableMeta(type):
     @classmethod
     def __prepare__(cls, name, bases, **kwargs):
@@ -471,6 +888,7 @@ class TableMeta(type):
 
     def __new__(cls, name, parents, dct, **kwargs):
         columns = []
+        indexes = []
 
         try:
             table_name = kwargs['table_name']
@@ -488,8 +906,14 @@ class TableMeta(type):
                     value.index_name = '%s_%s_idx' % (table_name, value.name)
 
                 columns.append(value)
+            elif isinstance(value, Index):
+                if value.name is None:
+                    value.name = '%s_%s_idx' % (table_name, elem)
+
+                indexes.append(value)
 
         dct['columns'] = columns
+        dct['indexes'] = indexes
         return super().__new__(cls, name, parents, dct)
 
     def __init__(self, name, parents, dct, **kwargs):
@@ -497,7 +921,7 @@ class TableMeta(type):
 
 class Table(metaclass=TableMeta):
     @classmethod
-    async def create_pool(cls, uri, **kwargs):
+    async def create_pool(cls, uri, *, replica_uri=None, max_replica_lag=10.0, **kwargs):
         r"""Sets up and returns the PostgreSQL connection pool that is used.
 
         .. note::
@@ -509,8 +933,19 @@ class Table(metaclass=TableMeta):
         -----------
         uri: str
             The PostgreSQL URI to connect to.
+        replica_uri: Optional[str]
+            The PostgreSQL URI of a read replica. If given, it's used by
+            :attr:`InstrumentedPool.read_pool` for read only queries.
+        max_replica_lag: float
+            How far behind in seconds the replica can be before read only
+            queries go to the primary instead.
         \*\*kwargs
             The arguments to forward to asyncpg.create_pool.
+
+        Returns
+        --------
+        :class:`InstrumentedPool`
+            The pool, wrapped so its usage can be inspected.
         """
 
         def _encode_jsonb(value):
@@ -526,7 +961,17 @@ class Table(metaclass=TableMeta):
             if old_init is not None:
                 await old_init(con)
 
-        cls._pool = pool = await asyncpg.create_pool(uri, init=init, **kwargs)
+        min_size, max_size = kwargs.get('min_size', 10), kwargs.get('max_size', 10)
+
+        replica = None
+        if replica_uri is not None:
+            replica = await asyncpg.create_pool(replica_uri, init=init, **kwargs)
+            replica = InstrumentedPool(replica, min_size=min_size, max_size=max_size)
+
+        pool = await asyncpg.create_pool(uri, init=init, **kwargs)
+        cls._pool = pool = InstrumentedPool(pool, min_size=min_size, max_size=max_size,
+                                                  replica=replica, max_replica_lag=max_replica_lag)
+        pool.start_monitor()
         return pool
 
     @classmethod
@@ -795,6 +1240,9 @@ class Table(metaclass=TableMeta):
                 fmt = 'CREATE INDEX IF NOT EXISTS {1.index_name} ON {0} ({1.name});'.format(cls.__tablename__, column)
                 statements.append(fmt)
 
+        for index in cls.indexes:
+            statements.append(index._create_index(cls.__tablename__))
+
         return '\n'.join(statements)
 
     @classmethod
@@ -833,6 +1281,7 @@ class Table(metaclass=TableMeta):
         # nb: columns is ordered due to the ordered dict usage
         #     this is used to help detect renames
         x['columns'] = [a._to_dict() for a in cls.columns]
+        x['indexes'] = [a._to_dict() for a in cls.indexes]
         return x
 
     @classmethod
@@ -847,6 +1296,8 @@ class Table(metaclass=TableMeta):
         self = cls()
         self.__tablename__ = data['name']
         self.columns = [Column.from_dict(a) for a in data['columns']]
+        # older data files predate table level indexes
+        self.indexes = [Index.from_dict(a) for a in data.get('indexes', [])]
         return self
 
     @classmethod
@@ -877,12 +1328,23 @@ class Table(metaclass=TableMeta):
         rename_columns:
             before: str [The previous column name]
             after:  str [The new column name]
+        backfill:
+            name: str [The name of a column added by this migration]
+            expression: str [The SQL expression to fill existing rows with]
         drop_index:
             name: str [The column name]
             index: str [The index name]
         add_index:
             name: str [The column name]
             index: str [The index name]
+
+            Table level indexes (see :class:`Index`) use this instead:
+
+            name: str [The index name]
+            index: str [The index name]
+            columns: List[str] [The columns or expressions]
+            where: Optional[str] [The partial index predicate]
+            unique: bool [Whether the index is unique]
         changed_constraints:
             name: str [The column name]
             before:
@@ -979,6 +1441,8 @@ class Table(metaclass=TableMeta):
                 as_dict = column._to_dict()
                 add.append(as_dict)
                 remove.append(as_dict)
+                if column.backfill is not None:
+                    upgrade.setdefault('backfill', []).append({ 'name': column.name, 'expression': column.backfill })
                 if column.index:
                     upgrade.setdefault('add_index', []).append({ 'name': column.name, 'index': column.index_name })
                     downgrade.setdefault('drop_index', []).append({ 'name': column.name, 'index': column.index_name })
@@ -1002,6 +1466,36 @@ class Table(metaclass=TableMeta):
             upgrade.setdefault('remove_columns', []).extend(removed)
             downgrade.setdefault('add_columns', []).extend(removed)
 
+        # table level indexes are matched up by name, a changed
+        # definition is just dropping the old one and creating the new one
+        before_indexes = { index.name: index for index in before.indexes }
+        after_indexes = { index.name: index for index in self.indexes }
+
+        def add_table_index(path, index):
+            as_dict = index._to_dict()
+            as_dict['index'] = index.name
+            path.setdefault('add_index', []).append(as_dict)
+
+        def drop_table_index(path, index):
+            path.setdefault('drop_index', []).append({ 'name': index.name, 'index': index.name })
+
+        for name, index in after_indexes.items():
+            old = before_indexes.get(name)
+            if old is not None and old._to_dict() == index._to_dict():
+                continue
+
+            if old is not None:
+                drop_table_index(upgrade, old)
+                add_table_index(downgrade, old)
+
+            add_table_index(upgrade, index)
+            drop_table_index(downgrade, index)
+
+        for name, index in before_indexes.items():
+            if name not in after_indexes:
+                drop_table_index(upgrade, index)
+                add_table_index(downgrade, index)
+
         return SchemaDiff(self, upgrade, downgrade)
 
 async def _table_creator(tables, *, verbose=True):
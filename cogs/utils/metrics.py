@@ -0,0 +1,66 @@
+import bisect
+
+class Histogram:
+    """A fixed bucket histogram, mainly meant for latencies in seconds.
+
+    It's cheap enough to feed on hot paths since adding a value
+    is a bisect and two additions. Percentiles are approximate and
+    are reported as the upper bound of the bucket they fall in.
+    """
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                       0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+    __slots__ = ('buckets', 'counts', 'total', 'sum', 'max')
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or self.DEFAULT_BUCKETS)
+        # the last count is for everything above the last bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def __len__(self):
+        return self.total
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def clear(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    @property
+    def mean(self):
+        return self.sum / self.total if self.total else 0.0
+
+    def percentile(self, p):
+        if self.total == 0:
+            return 0.0
+
+        wanted = self.total * p
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted and count:
+                if index == len(self.buckets):
+                    return self.max
+                return min(self.buckets[index], self.max)
+        return self.max
+
+    def summary(self, *, scale=1000.0, unit='ms'):
+        if self.total == 0:
+            return 'n=0'
+
+        def fmt(value):
+            return f'{value * scale:.2f}{unit}'
+
+        return f'n={self.total} p50={fmt(self.percentile(0.5))} p90={fmt(self.percentile(0.9))} ' \
+               f'p99={fmt(self.percentile(0.99))} max={fmt(self.max)}'
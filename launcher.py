@@ -3,12 +3,16 @@
 
 import sys
 import click
+import datetime
 import logging
 import asyncio
 import asyncpg
 import discord
 import importlib
 import contextlib
+import collections
+import random
+import time
 
 from bot import RoboDanny, initial_extensions
 from cogs.utils.db import Table
@@ -53,7 +57,8 @@ def run_bot():
     log = logging.getLogger()
 
     try:
-        pool = loop.run_until_complete(Table.create_pool(config.postgresql, command_timeout=60))
+        replica = getattr(config, 'postgresql_replica', None)
+        pool = loop.run_until_complete(Table.create_pool(config.postgresql, replica_uri=replica, command_timeout=60))
     except Exception as e:
         click.echo('Could not set up PostgreSQL. Exiting.', file=sys.stderr)
         log.exception('Could not set up PostgreSQL. Exiting.', exc_info=e)
@@ -245,6 +250,430 @@ def drop(cog, quiet):
 
     run(remove_databases(pool, cog, quiet))
 
+@main.group(short_help='benchmarks', options_metavar='[options]')
+def benchmark():
+    pass
+
+class TimerBenchmarkBot:
+    """Just enough of a bot for the Reminder cog to dispatch timers with."""
+
+    def __init__(self, pool, expected):
+        self.pool = pool
+        self.loop = asyncio.get_event_loop()
+        self.expected = expected
+        self.fired = 0
+        self.done = asyncio.Event()
+
+    @property
+    def config(self):
+        return config
+
+    def is_closed(self):
+        return False
+
+    def dispatch(self, event, *args, **kwargs):
+        if event == 'benchmark_timer_complete':
+            self.fired += 1
+            if self.fired >= self.expected:
+                self.done.set()
+
+async def run_timer_benchmark(pool, count, within, timeout):
+    from cogs.reminder import Reminder
+
+    click.echo(f'Inserting {count} timers...')
+    query = """INSERT INTO reminders (event, extra, expires, created)
+               SELECT 'benchmark', jsonb_build_object('args', jsonb_build_array(x.i), 'kwargs', '{}'::jsonb),
+                      $1::timestamp + x.i * $2::interval, $1::timestamp
+               FROM generate_series(0, $3 - 1) AS x(i);
+            """
+
+    start = datetime.datetime.utcnow() + datetime.timedelta(seconds=5)
+    step = datetime.timedelta(seconds=within / count)
+    await pool.execute(query, start, step, count)
+
+    bot = TimerBenchmarkBot(pool, count)
+    pool.reset_stats()
+    cog = Reminder(bot)
+    try:
+        await asyncio.wait_for(bot.done.wait(), timeout=within + timeout)
+    except asyncio.TimeoutError:
+        click.echo(f'Timed out with {count - bot.fired} timers left.', err=True)
+    finally:
+        cog.cog_unload()
+        await pool.execute("DELETE FROM reminders WHERE event = 'benchmark';")
+
+    lateness = cog.lateness.get('benchmark')
+    click.echo(f'Fired {bot.fired}/{count} timers.')
+    if lateness is not None:
+        click.echo(f'Lateness: {lateness.summary()}')
+    click.echo(f'Round trips: {pool.queries} ({pool.queries / max(bot.fired, 1):.4f} per timer)')
+
+@benchmark.command(short_help='benchmarks timer dispatch', options_metavar='[options]')
+@click.option('--count', help='how many timers to create', default=100000)
+@click.option('--within', help='how many seconds the timers are spread over', default=60.0)
+@click.option('--timeout', help='how many extra seconds to wait for stragglers', default=60.0)
+def timers(count, within, timeout):
+    """Measures how late timers fire when a lot of them are due at once.
+
+    This bulk inserts timers for a 'benchmark' event and runs the Reminder
+    cog's dispatcher against them with a stub bot, then reports how late
+    they fired and how many round trips it took.
+
+    The dispatcher claims every due timer in the table, so only run this
+    against a scratch database that no bot is running on.
+    """
+
+    run = asyncio.get_event_loop().run_until_complete
+    try:
+        pool = run(Table.create_pool(config.postgresql))
+    except Exception:
+        click.echo(f'Could not create PostgreSQL connection pool.\n{traceback.format_exc()}', err=True)
+        return
+
+    others = run(pool.fetchval("SELECT COUNT(*) FROM reminders WHERE event <> 'benchmark';"))
+    if others:
+        click.confirm(f'there are {others} real timers that would get claimed, continue?', abort=True)
+
+    run(run_timer_benchmark(pool, count, within, timeout))
+
+# guild IDs this small are never real snowflakes
+STAR_BENCHMARK_GUILD_ID = 1
+
+class StarBenchmarkHTTP:
+    """Stands in for the HTTP client and counts requests instead of making them."""
+
+    def __init__(self):
+        self.requests = collections.Counter()
+
+    async def edit_message(self, channel_id, message_id, **fields):
+        self.requests['edit'] += 1
+
+    async def delete_message(self, channel_id, message_id):
+        self.requests['delete'] += 1
+
+class StarBenchmarkUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.display_name = f'User {user_id}'
+
+    def avatar_url_as(self, **kwargs):
+        return 'https://cdn.discordapp.com/embed/avatars/0.png'
+
+class StarBenchmarkMessage:
+    """Has what a MessageSnapshot is made from."""
+
+    def __init__(self, message_id, channel, author, content):
+        self.id = message_id
+        self.channel = channel
+        self.guild = channel.guild
+        self.type = discord.MessageType.default
+        self.author = author
+        self.content = content
+        self.attachments = []
+        self.embeds = []
+        self.created_at = datetime.datetime.utcnow()
+        self._state = channel.guild
+
+class StarBenchmarkChannel:
+    def __init__(self, guild, channel_id):
+        self.guild = guild
+        self.id = channel_id
+
+    def is_nsfw(self):
+        return False
+
+    def permissions_for(self, member):
+        return discord.Permissions.all()
+
+    async def send(self, content, *, embed=None):
+        self.guild.http.requests['send'] += 1
+        return self.guild.make_message(self, self.guild.me, content)
+
+class StarBenchmarkGuild:
+    """A guild with a starboard channel and some channels to star messages in."""
+
+    def __init__(self, guild_id, channels):
+        self.id = guild_id
+        self.http = StarBenchmarkHTTP()
+        self.me = StarBenchmarkUser(guild_id)
+        self.starboard = StarBenchmarkChannel(self, guild_id + 1)
+        self.channels = [StarBenchmarkChannel(self, guild_id + 2 + i) for i in range(channels)]
+        self._channels = { channel.id: channel for channel in self.channels }
+        self._channels[self.starboard.id] = self.starboard
+        self._next_id = discord.utils.time_snowflake(datetime.datetime.utcnow())
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    def make_message(self, channel, author, content):
+        self._next_id += 1
+        return StarBenchmarkMessage(self._next_id, channel, author, content)
+
+class StarBenchmarkBot:
+    """Just enough of a bot for the Stars cog to star messages with."""
+
+    def __init__(self, pool, guild):
+        self.pool = pool
+        self.loop = asyncio.get_event_loop()
+        self.guild = guild
+
+    def get_guild(self, guild_id):
+        return self.guild if guild_id == self.guild.id else None
+
+    def get_cog(self, name):
+        return None
+
+    async def wait_until_ready(self):
+        pass
+
+async def start_star_benchmark(pool, messages, channels, threshold):
+    """Sets up a starboard for the benchmark guild and a cog to drive.
+
+    Returns the cog, the guild and the snapshots of the messages to star.
+    """
+    from cogs.stars import Stars, MessageSnapshot
+
+    guild = StarBenchmarkGuild(STAR_BENCHMARK_GUILD_ID, channels)
+    query = "INSERT INTO starboard (id, channel_id, threshold) VALUES ($1, $2, $3);"
+    await pool.execute(query, guild.id, guild.starboard.id, threshold)
+
+    cog = Stars(StarBenchmarkBot(pool, guild))
+    snapshots = []
+    for i in range(messages):
+        channel = guild.channels[i % channels]
+        snapshot = MessageSnapshot(guild.make_message(channel, StarBenchmarkUser(i + 1), f'message {i}'))
+        cog._message_cache[snapshot.id] = snapshot
+        snapshots.append(snapshot)
+    return cog, guild, snapshots
+
+async def finish_star_benchmark(pool, cog, guild, *, check=True):
+    """Checks the star counts against the starrers and cleans up."""
+    if not check:
+        cog.cog_unload()
+        await pool.execute("DELETE FROM starboard WHERE id=$1;", guild.id)
+        return
+
+    query = """SELECT COUNT(*) AS entries,
+                      COALESCE(SUM(star_count), 0) AS stars,
+                      COUNT(*) FILTER (WHERE star_count <> (SELECT COUNT(*) FROM starrers WHERE entry_id = entry.id))
+               FROM starboard_entries entry
+               WHERE guild_id=$1;
+            """
+    try:
+        entries, stars, mismatched = await pool.fetchrow(query, guild.id)
+    finally:
+        cog.cog_unload()
+        # everything else cascades
+        await pool.execute("DELETE FROM starboard WHERE id=$1;", guild.id)
+
+    click.echo(f'Entries: {entries}, stars: {stars}, star counts out of sync with the starrers: {mismatched}')
+    requests = ', '.join(f'{count} {kind}s' for kind, count in sorted(guild.http.requests.items())) or 'none'
+    click.echo(f'Discord requests: {requests}')
+    click.echo(f'Acquire wait: {pool.acquire_wait.summary()}, peak connections in use: {pool.peak_in_use}')
+
+def star_benchmark_pool():
+    run = asyncio.get_event_loop().run_until_complete
+    try:
+        pool = run(Table.create_pool(config.postgresql))
+    except Exception:
+        click.echo(f'Could not create PostgreSQL connection pool.\n{traceback.format_exc()}', err=True)
+        return None
+
+    if run(pool.fetchval("SELECT 1 FROM starboard WHERE id=$1;", STAR_BENCHMARK_GUILD_ID)):
+        click.echo(f'A starboard for guild ID {STAR_BENCHMARK_GUILD_ID} already exists, '
+                   'is another benchmark still running?', err=True)
+        return None
+    return pool
+
+async def run_star_lock_benchmark(pool, messages, starrers, channels):
+    from cogs.stars import StarError
+    from cogs.utils.metrics import Histogram
+
+    cog, guild, snapshots = await start_star_benchmark(pool, messages, channels, threshold=1)
+    latency = Histogram()
+    failed = 0
+
+    async def star(snapshot, starrer_id):
+        nonlocal failed
+        start = time.perf_counter()
+        try:
+            await cog.star_message(guild.get_channel(snapshot.channel_id), snapshot.id, starrer_id)
+        except StarError:
+            failed += 1
+        else:
+            latency.add(time.perf_counter() - start)
+
+    click.echo(f'Starring {messages} messages {starrers} times each...')
+    pool.reset_stats()
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[
+            star(snapshot, starrer_id)
+            for starrer_id in range(1, starrers + 1)
+            for snapshot in snapshots
+        ])
+        elapsed = time.perf_counter() - start
+        click.echo(f'Starred {latency.total}/{messages * starrers} times ({failed} failed) in {elapsed:.2f}s '
+                   f'({latency.total / elapsed:.1f} stars/s)')
+        click.echo(f'Latency: {latency.summary()}')
+    finally:
+        await finish_star_benchmark(pool, cog, guild)
+
+@benchmark.command(name='stars-locks', short_help='benchmarks concurrent starring', options_metavar='[options]')
+@click.option('--messages', help='how many messages to star', default=100)
+@click.option('--starrers', help='how many people star each message', default=50)
+@click.option('--channels', help='how many channels the messages are spread over', default=5)
+def stars_locks(messages, starrers, channels):
+    """Measures how many stars a second one guild can take.
+
+    Every message gets starred by every starrer at the same time through
+    star_message, so this shows how much the per message locks let
+    through. Discord is stubbed out, the database is not.
+
+    This creates a starboard for a fake guild and deletes it afterwards.
+    """
+
+    pool = star_benchmark_pool()
+    if pool is not None:
+        asyncio.get_event_loop().run_until_complete(run_star_lock_benchmark(pool, messages, starrers, channels))
+
+async def run_reaction_benchmark(pool, count, messages, users, within, channels):
+    cog, guild, snapshots = await start_star_benchmark(pool, messages, channels, threshold=3)
+    rng = random.Random(0)
+
+    # (message_id, user_id) that should be starred at the end
+    starred = set()
+    flushes = set()
+    burst = 100
+
+    click.echo(f'Reacting {count} times to {messages} messages over {within}s...')
+    pool.reset_stats()
+    start = time.perf_counter()
+    try:
+        for i in range(count):
+            snapshot = rng.choice(snapshots)
+            key = (snapshot.id, rng.randint(1, users))
+            star = key not in starred
+            if star:
+                starred.add(key)
+            else:
+                starred.discard(key)
+
+            cog.queue_reaction(guild.get_channel(snapshot.channel_id), key[0], key[1], star)
+            flushes.add(cog._reaction_batches[guild.id].task)
+            if i % burst == burst - 1:
+                await asyncio.sleep(within * burst / count)
+
+        queued = time.perf_counter() - start
+        await asyncio.gather(*flushes)
+        elapsed = time.perf_counter() - start
+        click.echo(f'Applied {count} reactions in {len(flushes)} batches in {elapsed:.2f}s '
+                   f'({count / elapsed:.1f} reactions/s, drained {elapsed - queued:.2f}s after the last one)')
+        click.echo(f'Expected stars: {len(starred)}, connections acquired: {pool.acquisitions}')
+    finally:
+        await finish_star_benchmark(pool, cog, guild)
+
+@benchmark.command(short_help='benchmarks star reaction floods', options_metavar='[options]')
+@click.option('--count', help='how many reactions to add or remove', default=20000)
+@click.option('--messages', help='how many messages get reacted to', default=200)
+@click.option('--users', help='how many people are reacting', default=500)
+@click.option('--within', help='how many seconds the reactions are spread over', default=10.0)
+@click.option('--channels', help='how many channels the messages are spread over', default=5)
+def reactions(count, messages, users, within, channels):
+    """Measures how quickly a flood of star reactions is applied.
+
+    Reactions go through queue_reaction like the gateway events do, and
+    toggle between starring and unstarring. Afterwards the star counts are
+    checked against what the flood should have left behind. Discord is
+    stubbed out, the database is not.
+
+    This creates a starboard for a fake guild and deletes it afterwards.
+    """
+
+    pool = star_benchmark_pool()
+    if pool is not None:
+        run = asyncio.get_event_loop().run_until_complete
+        run(run_reaction_benchmark(pool, count, messages, users, within, channels))
+
+async def run_star_random_benchmark(pool, rows, picks):
+    import bisect
+    from cogs.stars import PostSampler
+    from cogs.utils.metrics import Histogram
+
+    cog, guild, _ = await start_star_benchmark(pool, 0, 1, threshold=1)
+    try:
+        # post IDs are anything but evenly spread out, so half of them come in one
+        # burst and the other half trickle in about a second apart afterwards
+        click.echo(f'Inserting {rows} starboard entries...')
+        query = """INSERT INTO starboard_entries (bot_message_id, message_id, channel_id, author_id, guild_id, star_count)
+                   SELECT id, id + 1, $3, x.i % 1000, $1, 1 + x.i % 10
+                   FROM generate_series(0, $4 - 1) AS x(i),
+                   LATERAL (SELECT $2::bigint + x.i * 2 + GREATEST(x.i - $4 / 2, 0)::bigint * 4194304000 AS id) AS post;
+                """
+        first_id = discord.utils.time_snowflake(datetime.datetime(2017, 1, 1))
+        await pool.execute(query, guild.id, first_id, guild.channels[0].id, rows)
+        # like autovacuum would, so picks can use index only scans
+        await pool.execute('VACUUM ANALYZE starboard_entries;')
+
+        start = time.perf_counter()
+        await cog.random_post(guild.id, connection=pool)
+        sampler = 'a sampler' if isinstance(cog._post_samplers.get(guild.id), PostSampler) else 'index offsets'
+        click.echo(f'First pick took {(time.perf_counter() - start) * 1000:.2f}ms, using {sampler}')
+
+        latency = Histogram()
+        picked = []
+        for _ in range(picks):
+            start = time.perf_counter()
+            picked.append(await cog.random_post(guild.id, connection=pool))
+            latency.add(time.perf_counter() - start)
+
+        click.echo(f'Picked {picks} times ({len(set(picked))} distinct posts)')
+        click.echo(f'Latency: {latency.summary()}')
+
+        # every tenth of the posts should get a tenth of the picks
+        query = """SELECT MAX(bot_message_id)
+                   FROM (
+                       SELECT bot_message_id, ntile(10) OVER (ORDER BY bot_message_id) AS decile
+                       FROM starboard_entries
+                       WHERE guild_id=$1
+                   ) AS posts
+                   GROUP BY decile
+                   ORDER BY decile;
+                """
+        edges = [r[0] for r in await pool.fetch(query, guild.id)]
+        counts = [0] * len(edges)
+        for message_id in picked:
+            counts[bisect.bisect_left(edges, message_id)] += 1
+    finally:
+        # the entries were made up without any starrers
+        await finish_star_benchmark(pool, cog, guild, check=False)
+
+    expected = picks / len(counts)
+    chi_squared = sum((count - expected) ** 2 / expected for count in counts)
+    click.echo(f'Picks per tenth of the posts: {", ".join(map(str, counts))} (chi-squared: {chi_squared:.2f})')
+    # the 99.9th percentile of the chi-squared distribution with 9 degrees of freedom
+    if chi_squared > 27.88:
+        raise click.ClickException('The picks are not uniformly distributed over the posts.')
+
+@benchmark.command(name='star-random', short_help='benchmarks star random', options_metavar='[options]')
+@click.option('--rows', help='how many starboard entries the guild has', default=1000000)
+@click.option('--picks', help='how many random posts to pick', default=1000)
+def star_random(rows, picks):
+    """Measures how long picking a random starboard post takes.
+
+    This bulk inserts starboard entries with clustered IDs for a fake
+    guild and times random_post against them. Guilds above the cog's
+    sampler_limit skip a random number of rows of the index, smaller
+    ones get a sampler loaded on the first pick. The picks have to be
+    uniformly distributed over the posts or the benchmark fails.
+
+    The starboard and its entries are deleted afterwards.
+    """
+
+    pool = star_benchmark_pool()
+    if pool is not None:
+        asyncio.get_event_loop().run_until_complete(run_star_random_benchmark(pool, rows, picks))
+
 @main.command(short_help='migrates from JSON files')
 @click.argument('cogs', nargs=-1)
 @click.pass_context
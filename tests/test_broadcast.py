@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+import discord
+import pytest
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer, unused_port
+
+from cogs.utils import broadcast
+
+# what discord.py sees when it gives up on a rate limited send,
+# it retries a 429 five times before raising it
+RATE_LIMITED = [429] * 5
+
+class FakeDiscord:
+    """Serves the send message endpoint the way Discord does, rate limits included.
+
+    Every request takes ``delay`` seconds to answer, and keeps track of how
+    many sends are in flight across channels.
+    """
+
+    def __init__(self, monkeypatch, *, delay=0.01):
+        self.delay = delay
+        self.port = unused_port()
+        monkeypatch.setattr(discord.http.Route, 'BASE', f'http://127.0.0.1:{self.port}/api/v7')
+
+        self.http = None
+        # channel_id: [status], what the next requests are answered with
+        self.responses = {}
+        # channel_id: [time], when each request came in
+        self.requests = {}
+        # channel_id: [content]
+        self.sent = {}
+        # when the last 429 was handed out
+        self.rate_limited_at = None
+        self.active = 0
+        self.peak = 0
+
+    @staticmethod
+    def respond(data, *, status=200, headers=None):
+        # discord.py only decodes the body if the content type is exactly this,
+        # web.json_response adds a charset to it
+        headers = {'Content-Type': 'application/json', **(headers or {})}
+        return web.Response(body=json.dumps(data).encode('utf-8'), status=status, headers=headers)
+
+    def channel(self, channel_id, *responses):
+        self.responses[channel_id] = list(responses)
+        return Channel(self, channel_id)
+
+    async def send_message(self, request):
+        channel_id = int(request.match_info['channel_id'])
+        payload = await request.json()
+        self.requests.setdefault(channel_id, []).append(time.perf_counter())
+
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+
+        responses = self.responses.get(channel_id)
+        status = responses.pop(0) if responses else 200
+        if status == 429:
+            self.rate_limited_at = time.perf_counter()
+            data = {'message': 'You are being rate limited.', 'retry_after': 1, 'global': False}
+            # discord.py treats a 429 without Via as a Cloudflare ban
+            headers = {'Retry-After': '0.001', 'Via': '1.1 google'}
+            return self.respond(data, status=status, headers=headers)
+
+        if status != 200:
+            return self.respond({'message': 'Nope', 'code': 0}, status=status)
+
+        self.sent.setdefault(channel_id, []).append(payload['content'])
+        return self.respond({'id': '1', 'channel_id': str(channel_id), 'content': payload['content']})
+
+    def broadcast(self, destinations, **kwargs):
+        return asyncio.run(self._broadcast(destinations, **kwargs))
+
+    async def _broadcast(self, destinations, **kwargs):
+        app = web.Application()
+        app.router.add_post('/api/v7/channels/{channel_id}/messages', self.send_message)
+        server = TestServer(app, port=self.port)
+        await server.start_server()
+
+        self.http = discord.http.HTTPClient()
+        self.http._HTTPClient__session = aiohttp.ClientSession()
+        try:
+            return await broadcast.broadcast(destinations, **kwargs)
+        finally:
+            await self.http.close()
+            await server.close()
+
+class Channel:
+    """Sends through discord.py's HTTP client, like a TextChannel does."""
+
+    def __init__(self, api, channel_id):
+        self.api = api
+        self.id = channel_id
+
+    async def send(self, content):
+        await self.api.http.send_message(self.id, content)
+
+class BrokenChannel:
+    id = 0
+
+    async def send(self, content):
+        raise RuntimeError('broken')
+
+@pytest.fixture
+def api(monkeypatch):
+    return FakeDiscord(monkeypatch)
+
+def test_keeps_per_channel_order(api):
+    channels = [api.channel(i) for i in range(3)]
+    destinations = [(channel, f'{channel.id}-{n}') for n in range(5) for channel in channels]
+
+    result = api.broadcast(destinations, concurrency=3)
+
+    for channel in channels:
+        assert api.sent[channel.id] == [f'{channel.id}-{n}' for n in range(5)]
+    assert result.sent == 15
+
+def test_bounds_concurrency(api):
+    channels = [api.channel(i) for i in range(10)]
+    destinations = [(channel, 'hello') for channel in channels for _ in range(2)]
+
+    result = api.broadcast(destinations, concurrency=3)
+
+    assert api.peak == 3
+    assert result.sent == 20
+
+def test_sends_to_the_same_channel_one_at_a_time(api):
+    channel = api.channel(1)
+
+    api.broadcast([(channel, str(n)) for n in range(5)], concurrency=5)
+
+    assert api.peak == 1
+    assert api.sent[1] == [str(n) for n in range(5)]
+
+def test_backs_off_and_retries_when_rate_limited(api):
+    limited = api.channel(1, *RATE_LIMITED, *RATE_LIMITED)
+
+    result = api.broadcast([(limited, 'hello')], backoff=0.05)
+
+    assert api.sent[1] == ['hello']
+    assert result.sent == 1
+    assert result.rate_limited == 2
+    assert result.failed == 0
+
+    # the backoff doubles each time
+    requests = api.requests[1]
+    assert len(requests) == 11
+    first, second, third = requests[4], requests[5], requests[10]
+    assert second - first >= 0.05
+    assert third - second >= 0.1
+
+def test_rate_limit_pauses_every_channel(api):
+    limited = api.channel(1, *RATE_LIMITED)
+    other = api.channel(2)
+    destinations = [(limited, 'a')] + [(other, str(n)) for n in range(20)]
+
+    api.broadcast(destinations, backoff=0.2)
+
+    # once discord.py gives up on the 429 nobody sends anything until the
+    # backoff is over, a request that was already on its way is fine
+    paused_at = api.rate_limited_at
+    during = [t for t in api.requests[2] if paused_at + 0.02 < t < paused_at + 0.2]
+    after = [t for t in api.requests[2] if t >= paused_at + 0.2]
+    assert during == []
+    assert after
+    assert api.requests[1][-1] - paused_at >= 0.2
+    assert api.sent[1] == ['a']
+    assert api.sent[2] == [str(n) for n in range(20)]
+
+def test_gives_up_after_retries(api):
+    limited = api.channel(1, *RATE_LIMITED * 5)
+
+    result = api.broadcast([(limited, 'hello')], retries=2, backoff=0.01)
+
+    assert 1 not in api.sent
+    assert len(api.requests[1]) == 3 * len(RATE_LIMITED)
+    assert result.rate_limited == 2
+    assert result.failed == 1
+
+def test_counts(api, caplog):
+    ok = api.channel(1)
+    forbidden = api.channel(2, 403)
+    missing = api.channel(3, 404)
+    bad = api.channel(4, 400)
+    limited = api.channel(5, *RATE_LIMITED)
+    broken = BrokenChannel()
+
+    destinations = [
+        (ok, 'a'), (ok, 'b'), (forbidden, 'c'), (forbidden, 'd'), (missing, 'e'),
+        (bad, 'f'), (broken, 'g'), (limited, 'h'),
+    ]
+    with caplog.at_level(logging.WARNING, logger=broadcast.__name__):
+        result = api.broadcast(destinations, backoff=0.01)
+
+    assert api.sent[2] == ['d']
+    assert result.sent == 4
+    assert result.failed == 4
+    assert result.rate_limited == 1
+    assert result.total == 8
+    assert len(result.latency) == 4
+
+    # forbidden and missing channels are expected, anything else is logged
+    records = {record.getMessage(): record for record in caplog.records if record.name == broadcast.__name__}
+    assert len(records) == 2
+    assert any('channel ID 4' in message for message in records)
+    assert records['Could not broadcast to channel ID 0'].exc_info[0] is RuntimeError
@@ -0,0 +1,42 @@
+import asyncio
+
+from cogs.utils import db
+
+class FakePool:
+    """Hands out plain objects as connections."""
+
+    async def acquire(self, *, timeout=None):
+        return object()
+
+    async def release(self, connection, *, timeout=None):
+        pass
+
+async def acquire_with_maybe_acquire(pool):
+    async with db.MaybeAcquire(None, pool=pool):
+        pass
+
+async def acquire_with_async_with(pool):
+    async with pool.acquire():
+        pass
+
+async def acquire_with_await(pool):
+    con = await pool.acquire()
+    await pool.release(con)
+
+def test_hold_times_are_per_call_site():
+    pool = db.InstrumentedPool(FakePool())
+
+    async def run():
+        await acquire_with_maybe_acquire(pool)
+        await acquire_with_async_with(pool)
+        await acquire_with_await(pool)
+        await acquire_with_await(pool)
+
+    asyncio.run(run())
+
+    sites = { site.split(':')[1]: histogram.total for site, histogram in pool.hold_times.items() }
+    assert sites == {
+        'acquire_with_maybe_acquire': 1,
+        'acquire_with_async_with': 1,
+        'acquire_with_await': 2,
+    }
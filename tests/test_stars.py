@@ -0,0 +1,281 @@
+import asyncio
+import datetime
+import re
+import types
+
+import discord
+import pytest
+
+from cogs import stars
+from cogs.utils import cache
+
+class FakeConnection:
+    """Counts round trips instead of talking to PostgreSQL."""
+
+    def __init__(self, record):
+        self.record = record
+        self.calls = []
+
+    async def execute(self, query, *args):
+        self.calls.append('execute')
+
+    async def fetch(self, query, *args):
+        self.calls.append('fetch')
+        return [self.record]
+
+    async def fetchrow(self, query, *args):
+        self.calls.append('fetchrow')
+        return self.record
+
+    async def fetchval(self, query, *args):
+        self.calls.append('fetchval')
+        return self.record[0]
+
+def http_exception(cls, status):
+    response = types.SimpleNamespace(status=status, reason='')
+    return cls(response, '')
+
+class FakeChannel:
+    def __init__(self, guild, channel_id):
+        self.guild = guild
+        self.id = channel_id
+
+    def is_nsfw(self):
+        return False
+
+    def permissions_for(self, member):
+        return discord.Permissions.all()
+
+class FakeMessage:
+    """Has what a MessageSnapshot has."""
+
+    def __init__(self, message_id, channel_id, guild_id):
+        self.id = message_id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.type = discord.MessageType.default
+        self.author_id = 10
+        self.author_name = 'Someone'
+        self.author_avatar = 'https://cdn.discordapp.com/embed/avatars/0.png'
+        self.content = 'hello'
+        self.attachments = []
+        self.embeds = []
+        self.created_at = datetime.datetime.utcnow()
+        self.template = None
+        self.edits = []
+        # raised by the next edits, in order
+        self.failures = []
+
+    @property
+    def jump_url(self):
+        return f'https://discordapp.com/channels/{self.guild_id}/{self.channel_id}/{self.id}'
+
+    async def edit(self, *, content, embed):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.edits.append(content)
+
+GUILD_ID = 1
+MESSAGE_ID = 100
+POST_ID = 200
+
+def make_cog():
+    guild = types.SimpleNamespace(id=GUILD_ID, me=None)
+    starboard_channel = FakeChannel(guild, 2)
+    channel = FakeChannel(guild, 3)
+
+    starboard = types.SimpleNamespace(id=GUILD_ID, channel=starboard_channel, locked=False, threshold=2,
+                                      max_age=datetime.timedelta(days=7))
+    messages = {
+        MESSAGE_ID: FakeMessage(MESSAGE_ID, channel.id, GUILD_ID),
+        POST_ID: FakeMessage(POST_ID, starboard_channel.id, GUILD_ID),
+    }
+
+    cog = stars.Stars.__new__(stars.Stars)
+    cog.bot = types.SimpleNamespace(loop=asyncio.get_running_loop())
+    cog.spoilers = re.compile(r'\|\|(.+?)\|\|')
+    cog._edits = {}
+    cog._message_cache = cache.LRUCache(16, seconds=60)
+    cog._post_samplers = cache.LRUCache(16, seconds=60)
+    cog._dirty_leaderboards = set()
+    cog._about_to_be_deleted = set()
+    cog.edit_interval = 0
+
+    async def get_starboard(guild_id, *, connection=None):
+        return starboard
+
+    async def get_message(channel, message_id):
+        return messages.get(message_id)
+
+    cog.get_starboard = get_starboard
+    cog.get_message = get_message
+    return cog, channel, messages
+
+async def finish_edits(cog):
+    await asyncio.gather(*[edit.task for edit in list(cog._edits.values())])
+
+def test_star_is_one_round_trip():
+    async def star(record):
+        cog, channel, messages = make_cog()
+        con = FakeConnection(record)
+        await cog._star_message(channel, MESSAGE_ID, 20, connection=con)
+        await finish_edits(cog)
+        return con, messages
+
+    # below the threshold, so there's no post
+    con, messages = asyncio.run(star((1, None)))
+    assert con.calls == ['fetchrow']
+
+    # the post already exists and only gets edited
+    con, messages = asyncio.run(star((5, POST_ID)))
+    assert con.calls == ['fetchrow']
+    assert len(messages[POST_ID].edits) == 1
+
+def test_unstar_is_one_round_trip():
+    async def unstar(record):
+        cog, channel, messages = make_cog()
+        con = FakeConnection(record)
+        await cog._unstar_message(channel, MESSAGE_ID, 20, connection=con)
+        await finish_edits(cog)
+        return con, messages
+
+    # the last star, so the entry is gone and there was no post
+    con, messages = asyncio.run(unstar((1, None, 0)))
+    assert con.calls == ['fetchrow']
+
+    # still above the threshold, so the post only gets edited
+    con, messages = asyncio.run(unstar((1, POST_ID, 4)))
+    assert con.calls == ['fetchrow']
+    assert len(messages[POST_ID].edits) == 1
+
+def test_unstar_without_a_star():
+    async def unstar():
+        cog, channel, messages = make_cog()
+        con = FakeConnection(None)
+        with pytest.raises(stars.StarError):
+            await cog._unstar_message(channel, MESSAGE_ID, 20, connection=con)
+        return con
+
+    con = asyncio.run(unstar())
+    assert con.calls == ['fetchrow']
+
+def test_reaction_batches_are_applied_in_order():
+    applied = []
+
+    async def interleave():
+        cog, channel, messages = make_cog()
+        cog._reaction_batches = {}
+        cog._flush_locks = {GUILD_ID: asyncio.Lock()}
+        cog.ingest_interval = 0.01
+        cog.bot.get_guild = lambda guild_id: channel.guild
+
+        async def apply_reactions(guild, events):
+            applied.append(('start', dict(events)))
+            # the first batch is slow, e.g. it has to fetch the message
+            if len(applied) == 1:
+                await asyncio.sleep(0.1)
+            applied.append(('end', dict(events)))
+
+        cog.apply_reactions = apply_reactions
+
+        cog.queue_reaction(channel, MESSAGE_ID, 20, True)
+        first = cog._reaction_batches[GUILD_ID].task
+        # the star is being applied by the time the unstar comes in
+        await asyncio.sleep(0.05)
+        cog.queue_reaction(channel, MESSAGE_ID, 20, False)
+        second = cog._reaction_batches[GUILD_ID].task
+        await asyncio.gather(first, second)
+
+    asyncio.run(interleave())
+
+    key = (3, MESSAGE_ID, 20)
+    assert applied == [
+        ('start', {key: True}),
+        ('end', {key: True}),
+        ('start', {key: False}),
+        ('end', {key: False}),
+    ]
+
+def test_failed_edits_are_retried():
+    async def edit(failures):
+        cog, channel, messages = make_cog()
+        post = messages[POST_ID]
+        post.failures = list(failures)
+        attempts = len(post.failures)
+        cog.schedule_edit(post, 'hello', None)
+        await finish_edits(cog)
+        return post, attempts - len(post.failures)
+
+    # a server error is retried until the edit goes through
+    post, failed = asyncio.run(edit([http_exception(discord.HTTPException, 500)] * 2))
+    assert failed == 2
+    assert post.edits == ['hello']
+
+    # but not forever
+    post, failed = asyncio.run(edit([http_exception(discord.HTTPException, 500)] * 10))
+    assert failed == stars.Stars.edit_retries + 1
+    assert post.edits == []
+
+    # there's no point in retrying a deleted post
+    post, failed = asyncio.run(edit([http_exception(discord.NotFound, 404)] * 2))
+    assert failed == 1
+    assert post.edits == []
+
+class PostsConnection:
+    """Answers the random post queries from a list of post IDs."""
+
+    def __init__(self, posts):
+        self.posts = sorted(posts)
+        self.queries = []
+
+    async def fetchval(self, query, guild_id, *args):
+        if 'COUNT(*)' in query:
+            self.queries.append('count')
+            return len(self.posts)
+
+        self.queries.append('offset')
+        offset, = args
+        return self.posts[offset] if offset < len(self.posts) else None
+
+    async def fetch(self, query, guild_id):
+        self.queries.append('fetch')
+        return [(post,) for post in self.posts]
+
+def test_random_post_of_a_big_guild():
+    async def pick(posts, times):
+        cog, channel, messages = make_cog()
+        cog.sampler_limit = 2
+        con = PostsConnection(posts)
+        picked = [await cog.random_post(GUILD_ID, connection=con) for _ in range(times)]
+        return cog, con, picked
+
+    # only the count is cached, every pick skips into the index
+    cog, con, picked = asyncio.run(pick(range(10), 50))
+    assert isinstance(cog._post_samplers[GUILD_ID], stars.PostCount)
+    assert con.queries == ['count'] + ['offset'] * 50
+    assert set(picked) <= set(range(10))
+    assert len(set(picked)) > 1
+
+    async def stale():
+        cog, con, _ = await pick(range(10), 1)
+        # posts got deleted behind the cog's back
+        con.posts = con.posts[:5]
+        con.queries.clear()
+        picked = [await cog.random_post(GUILD_ID, connection=con) for _ in range(50)]
+        return cog, picked
+
+    cog, picked = asyncio.run(stale())
+    assert None not in picked
+    assert set(picked) <= set(range(5))
+    assert cog._post_samplers[GUILD_ID].count == 5
+
+def test_random_post_of_a_small_guild():
+    async def pick():
+        cog, channel, messages = make_cog()
+        con = PostsConnection(range(10))
+        picked = [await cog.random_post(GUILD_ID, connection=con) for _ in range(50)]
+        return con, picked
+
+    con, picked = asyncio.run(pick())
+    assert con.queries == ['count', 'fetch']
+    assert set(picked) <= set(range(10))